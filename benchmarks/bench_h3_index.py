@@ -0,0 +1,48 @@
+import numpy as np
+import pandas as pd
+import h3
+import time
+import sys
+
+sys.path.insert(0, "src/")
+from h3_index import geo_to_h3_array, geo_to_h3_multi
+
+"""
+benchmark batch h3 indexing against the row-wise df.apply path
+"""
+
+
+h3_resolution = 10
+sizes = [10_000, 100_000, 1_000_000]
+
+# random coords in the Budapest bounding box
+rng = np.random.default_rng(42)
+
+
+def timed(f):
+    start_time = time.perf_counter()
+    out = f()
+    return out, time.perf_counter() - start_time
+
+
+for n in sizes:
+    df = pd.DataFrame({
+        "mean_lat": rng.uniform(47.35, 47.61, n),
+        "mean_lon": rng.uniform(18.93, 19.33, n),
+    })
+
+    apply_cells, apply_time = timed(
+        lambda: df.apply(lambda r: h3.geo_to_h3(r["mean_lat"], r["mean_lon"], h3_resolution), axis=1)
+    )
+    batch_cells, batch_time = timed(
+        lambda: geo_to_h3_array(df["mean_lat"].to_numpy(), df["mean_lon"].to_numpy(), h3_resolution)
+    )
+    _, multi_time = timed(
+        lambda: geo_to_h3_multi(df["mean_lat"].to_numpy(), df["mean_lon"].to_numpy(), [7, 8, 9, 10])
+    )
+
+    assert (apply_cells.to_numpy() == batch_cells).all()
+    print(
+        "n=%9d  apply %8.3fs  batch %8.3fs  speedup %6.1fx  (4 resolutions %8.3fs)"
+        % (n, apply_time, batch_time, apply_time / batch_time, multi_time)
+    )
@@ -0,0 +1,163 @@
+import numpy as np
+import pandas as pd
+import os
+import sys
+import shutil
+import time
+import tempfile
+
+sys.path.insert(0, "src/")
+sys.path.insert(0, "benchmarks/")
+import synthetic_data
+import poi_complexity as poi_complexity_module
+import ub_explorer as ub_explorer_module
+import combine_data_for_figures as cdf
+from poi_complexity import poi_complexity, filter_out, selected_cat
+from ub_explorer import ub_explorer
+from polyfill import polyfill, add_hex_geometry
+from period_pipeline import run_periods
+from table_store import read_partitions
+from out_of_core import key_places_tables_out_of_core
+from instrumentation import rss_mb, reset_peak_rss, stage_peak_mb, can_reset_peak
+
+"""
+time and peak memory of every pipeline stage on synthetic data, over scales
+run from the repository root -- results go to outputs/benchmarks.csv
+"""
+
+
+scales = [1, 2, 4, 8]
+base_devices = 1_000
+base_pois = 10_000
+periods = ["2020-01", "2020-02"]
+h3_resolution = 10
+output_file = "outputs/benchmarks.csv"
+
+results = []
+
+
+def measure(stage, scale, f, *args):
+    """
+    run one stage, record wall / cpu time and peak rss -- rss covers the
+    pyarrow memory pool, which allocation tracing does not see
+    """
+    rss_before = rss_mb()
+    if can_reset_peak:
+        reset_peak_rss()
+    wall_start, cpu_start = time.perf_counter(), time.process_time()
+    out = f(*args)
+    wall, cpu = time.perf_counter() - wall_start, time.process_time() - cpu_start
+    peak = max(stage_peak_mb(), rss_before)
+
+    results.append({
+        "stage": stage,
+        "scale": scale,
+        "wall_s": round(wall, 4),
+        "cpu_s": round(cpu, 4),
+        "rss_before_mb": round(rss_before, 1),
+        "peak_rss_mb": round(peak, 1),
+        "peak_increase_mb": round(peak - rss_before, 1),
+        "rows_out": len(out) if hasattr(out, "__len__") else None,
+    })
+    print("  %-50s %8.3fs %10.1f MB" % (stage, wall, peak - rss_before))
+    return out
+
+
+def assert_same_table(expected, result, keys):
+    """same rows and values, regardless of row order and index"""
+    pd.testing.assert_frame_equal(
+        expected.sort_values(keys, kind="stable").reset_index(drop=True),
+        result.sort_values(keys, kind="stable").reset_index(drop=True),
+    )
+
+
+def price_hexes(tracts):
+    """hex price table as written by notebook 01"""
+    tracts = tracts.copy()
+    tracts["pred_real_price"] = np.exp(tracts["pred_price"]).astype(int)
+    tracts["price_group"] = pd.qcut(tracts["pred_real_price"], 10, labels=False)
+    bp_h3 = polyfill(tracts, h3_resolution)
+    return bp_h3[["h3_polyfill", "pred_price", "price_group", "pred_real_price"]].drop_duplicates()
+
+
+for scale in scales:
+    print("scale", scale)
+    folder = tempfile.mkdtemp(prefix="amenity_bench_")
+    paths = measure(
+        "synthetic data", scale, synthetic_data.write_dataset,
+        folder, periods, base_devices * scale, base_pois * scale
+    )
+
+    # point the pipeline at the synthetic inputs
+    ub_explorer_module.path_stops_folder = paths["stops_folder"]
+    poi_complexity_module.path_location_file = paths["location_file"]
+    poi_complexity_module.path_poi_file = paths["poi_file"]
+    poi_complexity_module.path_cache_folder = os.path.join(folder, "cache")
+
+    # poi_complexity stages, one by one
+    # stage cache in the temp folder -- only the sources go through it below
+    pc = poi_complexity()
+    # first read converts the sources to geoparquet, the second one loads the cache
+    location_data = measure("poi_complexity.prep_location_data", scale, pc.prep_location_data)
+    location_data = measure("poi_complexity.prep_location_data (cached)", scale, pc.prep_location_data)
+    raw_poi_data = measure("poi_complexity.prep_poi_data", scale, pc.prep_poi_data)
+    raw_poi_data = measure("poi_complexity.prep_poi_data (cached)", scale, pc.prep_poi_data)
+    poi_data = measure("poi_complexity.filter_poi_data", scale, pc.filter_poi_data, raw_poi_data, filter_out)
+    poi_data = measure("poi_complexity.pois_locations", scale, pc.pois_locations, poi_data, location_data)
+    table = measure("poi_complexity.create_category_location_table", scale, pc.create_category_location_table, poi_data, selected_cat)
+    table = measure("poi_complexity.filter_category_location_table", scale, pc.filter_category_location_table, table, 2, 2)
+    complexity_df = measure("poi_complexity.create_complexity_df", scale, pc.create_complexity_df, table)
+    location_complexity = measure("poi_complexity.create_location_complexity_table", scale, pc.create_location_complexity_table, location_data, complexity_df)
+    poi_table = measure("poi_complexity.create_poi_complexity_table", scale, pc.create_poi_complexity_table, complexity_df)
+
+    # ub_explorer table builders
+    ub = measure("ub_explorer.load_data", scale, ub_explorer, periods[0])
+    home = measure("ub_explorer.place_of_the_month (home)", scale, ub.place_of_the_month, ub.data, "home", h3_resolution)
+    work = measure("ub_explorer.place_of_the_month (work)", scale, ub.place_of_the_month, ub.data, "work", h3_resolution)
+    third = measure("ub_explorer.third_places_table", scale, ub.third_places_table, ub.data.copy(), h3_resolution)
+    tables = measure("ub_explorer.key_places_tables", scale, ub.key_places_tables, ub.data, h3_resolution)
+
+    # the single pass builder gives exactly the per table results
+    assert_same_table(home, tables[0], ["device_id", "year_month"])
+    assert_same_table(work, tables[1], ["device_id", "year_month"])
+    assert_same_table(third, tables[2], ["device_id", "year_month", "place_label"])
+    del ub
+
+    # out-of-core builder against the in-memory one on all periods
+    all_stops = pd.concat([ub_explorer(p).data for p in periods], ignore_index=True)
+    tables = ub_explorer(period=None, load=False).key_places_tables(all_stops, h3_resolution)
+    del all_stops
+    out_of_core_tables = measure(
+        "out_of_core.key_places_tables_out_of_core", scale, key_places_tables_out_of_core,
+        periods, h3_resolution, 8, os.path.join(folder, "spill")
+    )
+    for t, ooc, keys in zip(tables, out_of_core_tables, [["device_id", "year_month"]] * 2 + [["device_id", "year_month", "place_label"]]):
+        assert_same_table(t, ooc, keys)
+    del tables, out_of_core_tables
+
+    # notebook 02 loop
+    tracts = synthetic_data.census_tracts()
+    bp_h3 = measure("price hexes (notebook 01)", scale, price_hexes, tracts)
+    measure(
+        "notebook 02 run_periods", scale, run_periods,
+        periods, bp_h3, h3_resolution, os.path.join(folder, "home"), os.path.join(folder, "third")
+    )
+    third_df = read_partitions(os.path.join(folder, "third"))
+
+    # combine_data_for_figures
+    city_parts_hex = add_hex_geometry(polyfill(location_data, h3_resolution))
+    measure("cdf.add_poi_complexity_to_full_poi_data", scale, cdf.add_poi_complexity_to_full_poi_data, raw_poi_data, poi_table, h3_resolution)
+    location_hex_c = measure("cdf.hex_to_location_complexity", scale, cdf.hex_to_location_complexity, city_parts_hex, location_complexity)
+    measure("cdf.add_location_info_to_home_and_third_places", scale, cdf.add_location_info_to_home_and_third_places, third_df, location_hex_c, complexity_df)
+    measure("cdf.add_szlok_level_prices_to_home_locations", scale, cdf.add_szlok_level_prices_to_home_locations, tracts, third_df, h3_resolution)
+
+    shutil.rmtree(folder, ignore_errors=True)
+
+
+# scaling curves -- one row per stage, one column per scale
+results = pd.DataFrame(results)
+os.makedirs(os.path.dirname(output_file), exist_ok=True)
+results.to_csv(output_file, index=False)
+
+print(results.pivot(index="stage", columns="scale", values="wall_s"))
+print(results.pivot(index="stage", columns="scale", values="peak_increase_mb"))
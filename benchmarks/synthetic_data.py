@@ -0,0 +1,125 @@
+import os
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+from shapely.geometry import box
+
+
+"""
+synthetic stand-ins for the private inputs -- semantic stops, Google POIs,
+neighborhood and census tract polygons -- at configurable scale
+"""
+
+
+# Budapest bounding box
+min_lon, min_lat, max_lon, max_lat = 18.93, 47.35, 19.33, 47.61
+categories = ["cat_%02d" % i for i in range(78)]
+amenities = ["Restaurant", "Cafe", "Shop", "Service", "Health", "ATM", "Parking"]
+
+
+def grid_polygons(nx, ny, name_col, prefix):
+    """rectangular grid over the bounding box"""
+    xs = np.linspace(min_lon, max_lon, nx + 1)
+    ys = np.linspace(min_lat, max_lat, ny + 1)
+    cells = [box(xs[i], ys[j], xs[i + 1], ys[j + 1]) for i in range(nx) for j in range(ny)]
+    names = ["%s_%04d" % (prefix, k) for k in range(len(cells))]
+    return gpd.GeoDataFrame({name_col: names}, geometry=cells, crs="epsg:4326")
+
+
+def neighborhoods(nx=12, ny=10):
+    return grid_polygons(nx, ny, "NAME", "neighborhood")
+
+
+def census_tracts(nx=60, ny=50, seed=0):
+    rng = np.random.default_rng(seed)
+    tracts = grid_polygons(nx, ny, "TNev", "tract")
+    tracts["szlok"] = ["%04d" % k for k in range(len(tracts))]
+    tracts["district"] = ["district_%02d" % (k % 23 + 1) for k in range(len(tracts))]
+    tracts["pred_price"] = rng.normal(13.3, 0.3, len(tracts))
+    return tracts
+
+
+def pois(n_pois=50_000, seed=0):
+    """POI points with the columns poi_complexity uses"""
+    rng = np.random.default_rng(seed)
+
+    # clustered around a few centers, like real amenities
+    centers = rng.uniform([min_lon, min_lat], [max_lon, max_lat], size=(40, 2))
+    center = rng.integers(0, len(centers), n_pois)
+    lon = np.clip(centers[center, 0] + rng.normal(0, 0.015, n_pois), min_lon, max_lon)
+    lat = np.clip(centers[center, 1] + rng.normal(0, 0.01, n_pois), min_lat, max_lat)
+
+    # skewed category popularity
+    category_p = 1 / np.arange(1, len(categories) + 1)
+    category_p = category_p / category_p.sum()
+    amenity = rng.choice(amenities, n_pois, p=[0.3, 0.2, 0.3, 0.1, 0.06, 0.02, 0.02])
+
+    return gpd.GeoDataFrame(
+        {
+            "place_id": ["poi_%08d" % i for i in range(n_pois)],
+            "name": np.where(amenity == "ATM", "Bank ATM Corner", "Place"),
+            "amenity_category": amenity,
+            "mall": np.where(rng.random(n_pois) < 0.03, "Mall", None),
+            "category_78": rng.choice(categories, n_pois, p=category_p),
+        },
+        geometry=gpd.points_from_xy(lon, lat),
+        crs="epsg:4326",
+    )
+
+
+def stops(n_devices=2_000, period="2020-01", stops_per_device=120, seed=0):
+    """semantic stops of one month -- home, work and third place visits per device"""
+    rng = np.random.default_rng(seed)
+    start = pd.Timestamp(period + "-01")
+
+    home = rng.uniform([min_lon, min_lat], [max_lon, max_lat], size=(n_devices, 2))
+    work = rng.uniform([min_lon, min_lat], [max_lon, max_lat], size=(n_devices, 2))
+    n_third = 8
+    third = home[:, None, :] + rng.normal(0, 0.02, size=(n_devices, n_third, 2))
+
+    n = n_devices * stops_per_device
+    device = np.repeat(np.arange(n_devices), stops_per_device)
+    kind = rng.choice([0, 1, 2, 3], n, p=[0.4, 0.25, 0.3, 0.05])  # home, work, third, moving
+    third_label = rng.integers(0, n_third, n)
+
+    lon_lat = np.where(
+        (kind == 0)[:, None], home[device],
+        np.where((kind == 1)[:, None], work[device], third[device, third_label])
+    )
+    lon_lat = lon_lat + rng.normal(0, 0.0002, size=(n, 2))
+
+    place_label = np.where(kind == 0, 1, np.where(kind == 1, 2, third_label + 3))
+    place_label = np.where(kind == 3, -1, place_label)
+
+    return pd.DataFrame({
+        "device_id": np.char.add("device_", device.astype(str)),
+        "year_month": period,
+        "place_label": place_label,
+        "center__lon": lon_lat[:, 0],
+        "center__lat": lon_lat[:, 1],
+        "stop_number": np.tile(np.arange(stops_per_device), n_devices),
+        "home__identified": (kind == 0).astype(int),
+        "work__identified": (kind == 1).astype(int),
+        "interval__start": start + pd.to_timedelta(rng.integers(0, 28 * 24 * 3600, n), unit="s"),
+        "duration": rng.exponential(3600, n),
+    })
+
+
+def write_dataset(folder, periods, n_devices=2_000, n_pois=50_000, seed=0):
+    """write every synthetic input into folder, returns the paths"""
+    paths = {
+        "stops_folder": os.path.join(folder, "stops") + "/",
+        "location_file": os.path.join(folder, "neighborhoods.shp"),
+        "tracts_file": os.path.join(folder, "censustracts.shp"),
+        "poi_file": os.path.join(folder, "pois.geojson"),
+    }
+    os.makedirs(paths["stops_folder"], exist_ok=True)
+
+    for i, p in enumerate(periods):
+        stops(n_devices, p, seed=seed + i).to_parquet(
+            paths["stops_folder"] + p + ".parquet", index=False, row_group_size=200_000
+        )
+    neighborhoods().to_file(paths["location_file"])
+    census_tracts(seed=seed).to_file(paths["tracts_file"])
+    pois(n_pois, seed=seed).to_file(paths["poi_file"], driver="GeoJSON")
+    return paths
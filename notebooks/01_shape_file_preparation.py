@@ -2,10 +2,13 @@ import pandas as pd
 import numpy as np
 import geopandas as gpd
 import h3
-import h3pandas
 from shapely.geometry import Point, Polygon
-import pygeos
-gpd.options.use_pygeos = False
+import sys
+
+sys.path.insert(0, "src/")
+from polyfill import polyfill, add_hex_geometry, unique_cells
+from h3_index import as_h3_int
+from table_store import write_table
 
 
 
@@ -75,23 +78,22 @@ bp_szlok_prices["price_group"] = pd.qcut(bp_szlok_prices["pred_real_price"], 10,
 bp_szlok_prices = bp_szlok_prices.explode(index_parts=True)
 
 # fill szamlalokorzet polygons with h3 hexes
+# polygons smaller than a hex (ca 10% NA rows before) get the cell of an inside point,
+# unless that cell is already filled by another polygon
 h3_resolution = 10
-bp_h3 = bp_szlok_prices.h3.polyfill(h3_resolution, explode=True)
-
-# drop ca 10% of rows with NA for h3_polyfill -- ??
-bp_h3 = bp_h3.dropna(subset=["h3_polyfill"])
-
-def add_geometry(row):
-  """create hex geometry"""
-  points = h3.h3_to_geo_boundary(row["h3_polyfill"], True)
-  return Polygon(points)
-
-bp_h3['geometry_hex'] = bp_h3.apply(add_geometry, axis=1)
-bp_h3 = bp_h3.set_geometry("geometry_hex")
+polyfill_cache = "outputs/polyfill_cache/"
+bp_h3 = polyfill(bp_szlok_prices, h3_resolution, cache_folder=polyfill_cache)
+bp_h3 = add_hex_geometry(bp_h3)
 
-# save the key columns
+# save the key columns -- typed parquet, h3 as uint64
 bp_h3_price = bp_h3[["h3_polyfill", "pred_price", "price_group", "pred_real_price"]].drop_duplicates()
-bp_h3_price.to_csv("outputs/bp_hex_price.csv", index=False)
+bp_h3_price = pd.DataFrame(bp_h3_price).assign(h3_polyfill=as_h3_int(bp_h3_price["h3_polyfill"]))
+bp_h3_price = unique_cells(bp_h3_price)
+write_table(
+    bp_h3_price,
+    "outputs/bp_hex_prices.parquet",
+    schema={"pred_price": "float64", "price_group": "int8", "pred_real_price": "int64"},
+)
 
 
 
@@ -104,18 +106,10 @@ city_parts = city_parts.to_crs("epsg:4326")
 
 # fill city part polygons with h3 hexes
 h3_resolution = 10
-parts_h3 = city_parts.h3.polyfill(h3_resolution, explode=True)
-
-# drop rows with NA for h3_polyfill -- ??
-parts_h3 = parts_h3.dropna(subset=["h3_polyfill"])
-
-def add_geometry(row):
-  """create hex geometry"""
-  points = h3.h3_to_geo_boundary(row["h3_polyfill"], True)
-  return Polygon(points)
-
-parts_h3['geometry_hex'] = parts_h3.apply(add_geometry, axis=1)
-parts_h3 = parts_h3.set_geometry("geometry_hex")
+parts_h3 = polyfill(city_parts, h3_resolution, cache_folder=polyfill_cache)
+parts_h3 = add_hex_geometry(parts_h3)
 
-# save
-parts_h3.to_csv("output/neighborhoods_h3s.csv", index=False)
\ No newline at end of file
+# save -- geoparquet with both the polygon and the hex geometry
+parts_h3["h3_polyfill"] = as_h3_int(parts_h3["h3_polyfill"])
+parts_h3 = unique_cells(parts_h3)
+write_table(parts_h3, "outputs/neighborhoods_h3s.parquet", dictionary_cols=["NAME"])
\ No newline at end of file
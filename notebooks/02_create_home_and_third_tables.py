@@ -4,12 +4,13 @@ import geopandas as gpd
 import h3
 import h3pandas
 from geopy import distance
-from haversine import haversine_vector, Unit
 import time
 import sys
 
 sys.path.insert(0, "src/")
-from ub_explorer import ub_explorer
+from period_runner import run_periods_parallel
+from instrumentation import export_records, summarize
+from table_store import read_table
 
 """
 create tables for home / work / third places based on stop detection results
@@ -45,61 +46,36 @@ periods = [
 ]
 
 h3_resolution = 10
-bp_h3 = pd.read_csv("outputs/bp_hex_prices.csv")
-home_output = pd.DataFrame()
-third_output = pd.DataFrame()
+bp_h3 = read_table(
+    "outputs/bp_hex_prices.parquet",
+    columns=["h3_polyfill", "pred_price", "price_group", "pred_real_price"],
+)
 
-start_time = time.time()
-for p in periods:
-    ub = ub_explorer(period=p)
-
-    # create home / work tables
-    home_table = ub.place_of_the_month(ub.data, "home", h3_resolution)
-
-    # add price group info to HOME
-    home_table = pd.merge(
-        home_table, bp_h3, left_on="h3", right_on="h3_polyfill", how="left"
-    ).dropna(subset="price_group")
-
-    # append -- home
-    home_output = pd.concat([home_output, home_table], ignore_index=True)
-
-    # create third places table
-    third_df = ub.third_places_table(ub.data, h3_resolution)
+# month partitioned outputs -- read back with table_store.read_partitions
+home_root = "outputs/home_table"
+third_root = "outputs/third_table"
+mobility_root = "outputs/mobility_table"
 
-    # add price group to third places
-    third_df = pd.merge(
-        third_df, bp_h3, left_on="h3", right_on="h3_polyfill", how="left"
-    ).dropna(subset="price_group")
+# parallel run -- finished months are kept in the manifest and skipped on rerun
+n_workers = 4
+memory_budget_gb = 64
 
-    # add home price group to third places table
-    third_df = pd.merge(
-        third_df,
-        home_table,
-        on=["device_id", "year_month"],
-        how="left",
-        suffixes=["_third", "_home"],
-    )
-
-    # HUGE drop -- remove stops of users with NO identified home in year_month
-    third_df = third_df.dropna(subset=["h3_polyfill_home"])
-
-    # distance of third places
-    third_df["home_coords"] = list(
-        zip(third_df["mean_lat_home"], third_df["mean_lon_home"])
-    )
-    third_df["third_coords"] = list(
-        zip(third_df["mean_lat_third"], third_df["mean_lon_third"])
-    )
-    third_df["distance"] = haversine_vector(
-        third_df["home_coords"].tolist(), third_df["third_coords"].tolist()
-    )
-
-    # append -- third
-    third_output = pd.concat([third_output, third_df], ignore_index=True)
-
-# export
-home_output.to_csv("outputs/home_table_full.csv", index=False)
-third_output.to_csv("outputs/third_table_full.csv", index=False)
+start_time = time.time()
+manifest = run_periods_parallel(
+    periods,
+    bp_h3,
+    h3_resolution,
+    home_root,
+    third_root,
+    n_workers=n_workers,
+    memory_budget_gb=memory_budget_gb,
+    manifest_path="outputs/period_manifest.json",
+    mobility_root=mobility_root,
+)
+
+# stage records of every period -- time, memory and rows dropped per filter
+records = [r for entry in manifest.values() for r in entry.get("stages", [])]
+export_records(records, "outputs/stage_records")
+print(summarize(records).to_string(index=False))
 
 print("--- %s seconds ---" % round((time.time() - start_time), 3))
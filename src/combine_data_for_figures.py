@@ -3,6 +3,8 @@ import pandas as pd
 import geopandas as gpd
 import h3
 import h3pandas
+from h3_index import geo_to_h3_array, as_h3_int, h3_int_to_str
+from polyfill import polyfill, unique_cells
 
 
 
@@ -17,7 +19,8 @@ def add_poi_complexity_to_full_poi_data(raw_poi_data, poi_complexity_data, h3_re
     )
 
     # add h3 hex based on h3_resolution
-    poi_hex_c["h3"] = poi_hex_c.apply(lambda r: h3.geo_to_h3(r["geometry"].y, r["geometry"].x, h3_resolution), axis=1)
+    poi_points = gpd.GeoSeries(poi_hex_c["geometry"])
+    poi_hex_c["h3"] = geo_to_h3_array(poi_points.y.to_numpy(), poi_points.x.to_numpy(), h3_resolution)
 
     return poi_hex_c
 
@@ -38,9 +41,32 @@ def hex_to_location_complexity(city_parts_hex, location_complexity):
     return location_hex_c
 
 
+def to_output_keys(df, h3_cols=(), name_cols=()):
+    """compact join keys back to the output types -- hex string h3 cells, plain location names"""
+    converted = {c: h3_int_to_str(df[c].to_numpy()) for c in h3_cols if c in df.columns}
+    converted.update({c: df[c].astype(object) for c in name_cols if c in df.columns})
+    return df.assign(**converted)
+
+
 def add_location_info_to_home_and_third_places(third_df, location_hex_c, complexity_df):
-    """add city part level location info to homes and third places"""
-    
+    """
+    add city part level location info to homes and third places -- joined on
+    uint64 h3 keys, returned with hex string cells as before
+    """
+
+    # compact join keys -- uint64 h3 cells, location names with one shared categorical dtype
+    location_names = pd.CategoricalDtype(
+        pd.unique(pd.concat([location_hex_c["location_name"], complexity_df["location_name"]]).dropna())
+    )
+    location_hex_c = location_hex_c.assign(
+        h3_part=as_h3_int(location_hex_c["h3_part"]),
+        location_name=location_hex_c["location_name"].astype(location_names)
+    )
+    third_df = third_df.assign(
+        h3_third=as_h3_int(third_df["h3_third"]),
+        h3_home=as_h3_int(third_df["h3_home"])
+    )
+
     # join city part name and complexity to third places
     third_c = pd.merge(
         third_df,
@@ -65,6 +91,7 @@ def add_location_info_to_home_and_third_places(third_df, location_hex_c, complex
         .groupby(["location_name"])\
         .agg(avg_ubiquity = pd.NamedAgg("ubiquity", "mean"))\
         .reset_index()
+    avg_ubiquity["location_name"] = avg_ubiquity["location_name"].astype(location_names)
 
     third_c = pd.merge(
         third_c,
@@ -73,11 +100,15 @@ def add_location_info_to_home_and_third_places(third_df, location_hex_c, complex
         right_on="location_name",
         how="left"
     )
-    
-    return third_c
+
+    return to_output_keys(
+        third_c,
+        ["h3_third", "h3_home", "h3_part_third", "h3_part_home"],
+        ["location_name_third", "location_name_home", "location_name"]
+    )
 
 
-def add_szlok_level_prices_to_home_locations(bp_szlok, third_df, h3_resolution):
+def add_szlok_level_prices_to_home_locations(bp_szlok, third_df, h3_resolution, polyfill_cache=None):
     """add szlok ids and predicted prices to home locations in home-third places table"""
     
     # geometry setting
@@ -92,12 +123,16 @@ def add_szlok_level_prices_to_home_locations(bp_szlok, third_df, h3_resolution):
     # explode multipolygons
     bp_szlok = bp_szlok.explode(index_parts=True)
 
-    # fill szamlalokorzet polygons with h3 hexes
+    # fill szamlalokorzet polygons with h3 hexes -- loaded from polyfill_cache after the first call
+    # polygons smaller than a hex (ca 10% NA rows before) get the cell of an inside point,
+    # unless that cell is already filled by another polygon
     h3_resolution = 10
-    bp_h3 = bp_szlok.h3.polyfill(h3_resolution, explode=True)
+    bp_h3 = polyfill(bp_szlok, h3_resolution, cache_folder=polyfill_cache)
 
-    # drop ca 10% of rows with NA for h3_polyfill -- ??
-    bp_h3 = bp_h3.dropna(subset=["h3_polyfill"])
+    # uint64 join keys
+    bp_h3["h3_polyfill"] = as_h3_int(bp_h3["h3_polyfill"])
+    bp_h3 = unique_cells(bp_h3)
+    third_df = third_df.assign(h3_home=as_h3_int(third_df["h3_home"]))
 
     # add szlok info to home locations in bp_h3
     third_h = pd.merge(
@@ -108,7 +143,99 @@ def add_szlok_level_prices_to_home_locations(bp_szlok, third_df, h3_resolution):
         how="left"
     )
 
-    return third_h
+    return to_output_keys(third_h, ["h3_home", "h3_polyfill"])
+
+
+def visit_matrix(unit_codes, group_codes, n_units, n_groups, weights=None):
+    """
+    dense unit x home price group matrix of (weighted) visits from one integer
+    bincount -- with ~10 price groups a dense matrix is small
+    """
+    flat = unit_codes * n_groups + group_codes
+    counts = np.bincount(flat, weights=weights, minlength=n_units * n_groups)
+    return counts.reshape(n_units, n_groups).astype(np.float64)
+
+
+def mixing_measures(matrix):
+    """
+    per unit -- total, entropy and evenness (entropy / log of the number of
+    groups) of the visitor price groups, and mixing: 1 minus the dissimilarity
+    of the unit's visitors from the visit weighted city-wide distribution
+    """
+    totals = matrix.sum(axis=1)
+    n_groups = matrix.shape[1]
+    empty = totals == 0
+    shares = matrix / np.where(empty, 1, totals)[:, None]
+
+    # zero shares add nothing to the entropy
+    log_shares = np.log(shares, where=shares > 0, out=np.zeros_like(shares))
+    entropy = -(shares * log_shares).sum(axis=1)
+
+    # evenness is undefined with a single price group
+    if n_groups > 1:
+        evenness = entropy / np.log(n_groups)
+    else:
+        evenness = np.full(len(totals), np.nan)
+
+    city_shares = matrix.sum(axis=0) / totals.sum()
+    mixing = 1 - 0.5 * np.abs(shares - city_shares).sum(axis=1)
+
+    return pd.DataFrame({
+        "total": totals,
+        "entropy": np.where(empty, np.nan, entropy),
+        "evenness": np.where(empty, np.nan, evenness),
+        "mixing": np.where(empty, np.nan, mixing),
+    })
+
+
+def distinct_visitors(unit_codes, group_codes, device_codes, n_groups, n_devices):
+    """unit and group codes of the distinct (unit, group, device) combinations"""
+    combinations = np.unique((unit_codes * n_groups + group_codes) * n_devices + device_codes)
+    cells = combinations // n_devices
+    return cells // n_groups, cells % n_groups
+
+
+def socio_economic_mixing(third_c, unit_cols=None, group_col="price_group_home",
+                          weight_cols=("nr_visits", "nr_days"), device_col="device_id"):
+    """
+    mixing of third place visitors by home price group, for every unit type in one pass
+    third_c: third places with home price groups (e.g. all months from read_partitions)
+    weighting "visitors" counts distinct devices per unit and price group, the
+    others sum weight_cols over the device x place rows
+    returns {unit type: one row per unit and weighting}
+    """
+    if unit_cols is None:
+        unit_cols = {"location": "location_name_third", "h3": "h3_third"}
+    third_c = third_c.dropna(subset=[group_col])
+    group_codes, groups = pd.factorize(third_c[group_col], sort=True)
+    device_codes, devices = pd.factorize(third_c[device_col])
+    weights = {w: third_c[w].to_numpy(dtype=np.float64) for w in weight_cols}
+
+    tables = {}
+    for unit_type, unit_col in unit_cols.items():
+        unit_codes, units = pd.factorize(third_c[unit_col], sort=True)
+        keep = unit_codes >= 0
+
+        # distinct visitors, then the weighted visit sums
+        matrices = {}
+        visitor_units, visitor_groups = distinct_visitors(
+            unit_codes[keep], group_codes[keep], device_codes[keep], len(groups), len(devices)
+        )
+        matrices["visitors"] = visit_matrix(visitor_units, visitor_groups, len(units), len(groups))
+        for w, values in weights.items():
+            matrices[w] = visit_matrix(
+                unit_codes[keep], group_codes[keep], len(units), len(groups), values[keep]
+            )
+
+        parts = []
+        for weighting, matrix in matrices.items():
+            part = mixing_measures(matrix)
+            part.insert(0, "weighting", weighting)
+            part.insert(0, unit_col, units)
+            parts.append(part)
+        tables[unit_type] = pd.concat(parts, ignore_index=True)
+
+    return tables
 
 
 # city part -- population
@@ -0,0 +1,143 @@
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from scipy.sparse.linalg import LinearOperator, eigsh
+
+
+"""
+sparse economic complexity measures -- RCA, Mcp, diversity, ubiquity, ECI, PCI
+
+follows the Growth Lab ecomplexity package (presence by rca >= 1, eigenvector
+of the second largest eigenvalue, sign set by correlation with diversity,
+PCI standardized with the ECI mean and std) without dense location x category
+matrices, so h3 cells can be used as locations
+"""
+
+
+def count_matrix(df, loc_col, prod_col, val_col):
+    """sparse location x category matrix from a long table, with the row / column labels"""
+    loc_codes, locs = pd.factorize(df[loc_col], sort=True)
+    prod_codes, prods = pd.factorize(df[prod_col], sort=True)
+    keep = (loc_codes >= 0) & (prod_codes >= 0)
+
+    counts = sparse.csr_matrix(
+        (df[val_col].to_numpy(dtype=np.float64)[keep], (loc_codes[keep], prod_codes[keep])),
+        shape=(len(locs), len(prods))
+    )
+    counts.sum_duplicates()
+    counts.eliminate_zeros()
+    return counts, locs, prods
+
+
+def rca_values(counts):
+    """RCA for the stored cells of a csr count matrix, aligned with counts.tocoo()"""
+    coo = counts.tocoo()
+    loc_total = np.asarray(counts.sum(axis=1)).ravel()
+    prod_total = np.asarray(counts.sum(axis=0)).ravel()
+    total = coo.data.sum()
+    rca = (coo.data / loc_total[coo.row]) / (prod_total[coo.col] / total)
+    return coo, rca
+
+
+def mcp_matrix(coo, rca, rca_threshold=1):
+    """binary presence matrix (csr) from RCA values"""
+    present = rca >= rca_threshold
+    return sparse.csr_matrix(
+        (np.ones(present.sum()), (coo.row[present], coo.col[present])),
+        shape=coo.shape
+    )
+
+
+def eci_pci(mcp, v0=None, dense_limit=1000):
+    """
+    ECI / PCI from a sparse Mcp matrix
+
+    the category side matrix Mpp = Kp^-1 M' Kc^-1 M is similar to the symmetric
+    A'A with A = Kc^-1/2 M Kp^-1/2, so its second eigenvector comes from eigsh
+    on A'A -- never building Mcc or Mpp for large category sets
+    v0: previous eigenvector -- warm started eigsh, also below dense_limit
+    returns eci, pci and the raw eigenvector (usable as v0 for a warm start)
+    """
+    diversity = np.asarray(mcp.sum(axis=1)).ravel()
+    ubiquity = np.asarray(mcp.sum(axis=0)).ravel()
+    loc_ok = diversity > 0
+    prod_ok = ubiquity > 0
+
+    m = mcp[loc_ok][:, prod_ok].tocsr()
+    kc_inv = 1 / diversity[loc_ok]
+    kp_sqrt_inv = 1 / np.sqrt(ubiquity[prod_ok])
+    a = sparse.diags(np.sqrt(kc_inv)) @ m @ sparse.diags(kp_sqrt_inv)
+    n = a.shape[1]
+
+    eci = np.full(len(diversity), np.nan)
+    pci = np.full(len(ubiquity), np.nan)
+    if n < 2:
+        return eci, pci, None
+
+    if v0 is not None and len(v0) != n:
+        v0 = None
+
+    # dense solve for small category sets, unless a warm start is given --
+    # eigsh from v0 then converges in a few iterations (it needs n > 3)
+    if n <= 3 or (n <= dense_limit and v0 is None):
+        _, eigvecs = np.linalg.eigh((a.T @ a).toarray())
+        v = eigvecs[:, -2]
+    else:
+        a_t = a.T.tocsr()
+        op = LinearOperator((n, n), matvec=lambda x: a_t @ (a @ x), dtype=np.float64)
+        eigvals, eigvecs = eigsh(op, k=2, which="LA", v0=v0)
+        v = eigvecs[:, np.argsort(eigvals)[0]]
+
+    # back to the eigenvector of Mpp, then the location side
+    kp = kp_sqrt_inv * v
+    kc = kc_inv * (m @ kp)
+
+    # sign so that ECI correlates positively with diversity
+    sign = np.sign(np.corrcoef(diversity[loc_ok], kc)[0, 1])
+    if sign == 0 or np.isnan(sign):
+        sign = 1
+    kc = sign * kc
+    kp = sign * kp
+
+    # normalization as in ecomplexity / STATA
+    eci_mean, eci_std = kc.mean(), kc.std()
+    eci[loc_ok] = (kc - eci_mean) / eci_std
+    pci[prod_ok] = (kp - eci_mean) / eci_std
+    return eci, pci, v
+
+
+def complexity_table(df, loc_col, prod_col, val_col, rca_threshold=1, v0=None, return_eigenvector=False):
+    """
+    long complexity table with the ecomplexity columns used downstream
+    (val, rca, mcp, diversity, ubiquity, eci, pci) -- one row per non-zero cell
+    v0: eigenvector of a previous solve (Series by category) as warm start
+    """
+    counts, locs, prods = count_matrix(df, loc_col, prod_col, val_col)
+    coo, rca = rca_values(counts)
+    mcp = mcp_matrix(coo, rca, rca_threshold)
+    diversity = np.asarray(mcp.sum(axis=1)).ravel()
+    ubiquity = np.asarray(mcp.sum(axis=0)).ravel()
+
+    # align a previous eigenvector to the current categories
+    solved_prods = prods[ubiquity > 0]
+    if v0 is not None:
+        v0 = v0.reindex(solved_prods).fillna(0).to_numpy()
+        if not v0.any():
+            v0 = None
+    eci, pci, v = eci_pci(mcp, v0=v0)
+
+    complexity_df = pd.DataFrame({
+        loc_col: locs.take(coo.row),
+        prod_col: prods.take(coo.col),
+        val_col: coo.data.astype(df[val_col].dtype, copy=False),
+        "diversity": diversity[coo.row],
+        "ubiquity": ubiquity[coo.col],
+        "mcp": (rca >= rca_threshold).astype(int),
+        "eci": eci[coo.row],
+        "pci": pci[coo.col],
+        "rca": rca,
+    })
+    if return_eigenvector:
+        eigenvector = None if v is None else pd.Series(v, index=solved_prods)
+        return complexity_df, eigenvector
+    return complexity_df
@@ -0,0 +1,84 @@
+import itertools
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+from poi_complexity import poi_complexity, poi_columns, selected_cat
+from complexity_engine import complexity_table
+
+
+"""
+robustness sweeps of location / amenity complexity over parameter grids
+"""
+
+
+def sweep_setting(table, category_col, min_categories, min_pois):
+    """complexity for one threshold setting -- tidy rows for locations and categories"""
+    table = table[(table["nr_categories"] >= min_categories) & (table["poi_count"] >= min_pois)]
+    complexity_df = complexity_table(table, "location_name", category_col, "poi_count")
+
+    locations = complexity_df[["location_name", "eci", "diversity"]].drop_duplicates()
+    locations = locations.rename(columns={"location_name": "name", "eci": "complexity", "diversity": "degree"})
+    locations.insert(0, "level", "location")
+
+    categories = complexity_df[[category_col, "pci", "ubiquity"]].drop_duplicates()
+    categories = categories.rename(columns={category_col: "name", "pci": "complexity", "ubiquity": "degree"})
+    categories.insert(0, "level", "category")
+
+    return pd.concat([locations, categories], ignore_index=True)
+
+
+class complexity_sweep(poi_complexity):
+    """
+    load and spatially join POIs once, then evaluate complexity over a parameter grid
+    """
+
+    def __init__(self, use_cache=True, recorder=None, category_cols=(selected_cat,)):
+        # every category column the sweep compares is read with the raw POIs
+        super().__init__(use_cache, recorder, poi_columns + list(category_cols))
+
+        # filters are row masks, so joining every POI once serves all settings
+        with self.recorder.stage("joined_poi_data", len(self.raw_poi_data)) as record:
+            joined = self.pois_locations(self.raw_poi_data, self.location_data)
+            self.joined_poi_data = pd.DataFrame(joined.drop(columns=joined.geometry.name))
+            record["rows_out"] = len(self.joined_poi_data)
+
+    def base_table(self, filter_list, category_col):
+        """category location table before the threshold filters"""
+        filtered = self.filter_poi_data(self.joined_poi_data, filter_list, category_col)
+        return self.create_category_location_table(filtered, category_col)
+
+    def run(self, filter_lists, category_cols, min_categories_list, min_pois_list, n_workers=1):
+        """
+        complexity for every combination of the parameter lists, in one tidy table
+        columns: setting parameters, level (location / category), name, complexity, degree
+        """
+        missing = [c for c in category_cols if c not in self.joined_poi_data.columns]
+        if missing:
+            raise KeyError("category columns not loaded, pass them as category_cols at construction: %s" % missing)
+
+        # shared intermediate tables -- one per filter and category choice
+        base_tables = {
+            (tuple(f), c): self.base_table(f, c)
+            for f, c in itertools.product(filter_lists, category_cols)
+        }
+
+        settings = list(itertools.product(base_tables, min_categories_list, min_pois_list))
+        args = [
+            (base_tables[key], key[1], min_c, min_p)
+            for key, min_c, min_p in settings
+        ]
+
+        if n_workers > 1:
+            with ProcessPoolExecutor(max_workers=n_workers) as pool:
+                results = list(pool.map(sweep_setting, *zip(*args)))
+        else:
+            results = [sweep_setting(*a) for a in args]
+
+        output = []
+        for ((filters, category_col), min_c, min_p), result in zip(settings, results):
+            result.insert(0, "min_pois_per_category", min_p)
+            result.insert(0, "min_categories_per_location", min_c)
+            result.insert(0, "category_col", category_col)
+            result.insert(0, "filter_out", ",".join(filters))
+            output.append(result)
+
+        return pd.concat(output, ignore_index=True)
@@ -0,0 +1,25 @@
+import os
+import hashlib
+
+
+"""
+cheap fingerprints of input files and parameters -- used as cache keys
+"""
+
+
+def file_fingerprint(path):
+    """fingerprint of an input file -- size and modification time"""
+    stat = os.stat(path)
+    return "%d-%d" % (stat.st_size, stat.st_mtime_ns)
+
+
+def key_hash(*parts):
+    """short stable hash of any printable key parts"""
+    return hashlib.sha1(repr(parts).encode()).hexdigest()[:16]
+
+
+def code_fingerprint(f):
+    """fingerprint of a function's code -- changes when its body changes"""
+    code = getattr(f, "__code__", f)
+    consts = tuple(code_fingerprint(c) if hasattr(c, "co_code") else c for c in code.co_consts)
+    return key_hash(code.co_code, consts, code.co_names)
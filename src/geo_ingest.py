@@ -0,0 +1,47 @@
+import os
+import geopandas as gpd
+from fingerprint import file_fingerprint, key_hash
+
+try:
+    import pyogrio
+except ImportError:
+    pyogrio = None
+
+
+"""
+columnar ingestion of GeoJSON / shapefile sources
+
+sources are read through pyogrio's arrow reader (only the selected columns),
+converted once to geoparquet in the stage cache, keyed by the file fingerprint
+and the columns, and memory-mapped from the cache afterwards
+"""
+
+
+def source_stage(path):
+    return "source_" + os.path.splitext(os.path.basename(path))[0]
+
+
+def source_key(path, columns):
+    return key_hash(os.path.abspath(path), file_fingerprint(path), None if columns is None else sorted(columns))
+
+
+def read_source(path, columns=None):
+    """read the selected columns (and the geometry) of a GeoJSON / shapefile"""
+    if pyogrio is not None:
+        return gpd.read_file(path, columns=columns, engine="pyogrio", use_arrow=True)
+    gdf = gpd.read_file(path)
+    if columns is not None:
+        gdf = gdf[list(columns) + [gdf.geometry.name]]
+    return gdf
+
+
+def read_geo(path, columns=None, cache=None):
+    """
+    GeoDataFrame of a source file -- through the stage cache when given, so the
+    source is converted once and falls under the cache's size limit
+    """
+    if cache is None:
+        return read_source(path, columns)
+    return cache.get_or_compute(
+        source_stage(path), source_key(path, columns), lambda: read_source(path, columns)
+    )
@@ -0,0 +1,107 @@
+import warnings
+import numpy as np
+import h3
+
+# h3.unstable warns on import -- silenced for this import only
+try:
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", UserWarning)
+        from h3.unstable import vect as h3_vect
+except ImportError:
+    h3_vect = None
+
+
+"""
+batch h3 indexing -- one call per column instead of one call per row
+"""
+
+
+def geo_to_h3_int(lats, lons, h3_resolution):
+    """h3 cells (uint64) for lat / lon arrays, 0 where coords are missing"""
+    lats = np.ascontiguousarray(lats, dtype=np.float64)
+    lons = np.ascontiguousarray(lons, dtype=np.float64)
+    valid = np.isfinite(lats) & np.isfinite(lons)
+
+    cells = np.zeros(len(lats), dtype=np.uint64)
+    if not valid.any():
+        return cells
+
+    if h3_vect is not None:
+        cells[valid] = h3_vect.geo_to_h3(lats[valid], lons[valid], h3_resolution)
+    else:
+        # fallback for h3 builds without the vectorized api
+        cells[valid] = np.fromiter(
+            (h3.string_to_h3(h3.geo_to_h3(la, lo, h3_resolution))
+             for la, lo in zip(lats[valid], lons[valid])),
+            dtype=np.uint64,
+            count=int(valid.sum())
+        )
+    return cells
+
+
+def h3_int_to_str(cells):
+    """uint64 h3 cells to hex strings, None for 0"""
+    cells = np.asarray(cells, dtype=np.uint64)
+    return np.array(
+        [format(c, "x") if c else None for c in cells.tolist()],
+        dtype=object
+    )
+
+
+def h3_str_to_int(cells):
+    """hex string h3 cells to uint64, 0 for missing"""
+    return np.fromiter(
+        (int(c, 16) if isinstance(c, str) else 0 for c in cells),
+        dtype=np.uint64,
+        count=len(cells)
+    )
+
+
+def as_h3_int(values):
+    """h3 column as uint64 whether it holds hex strings or integers"""
+    values = np.asarray(values)
+    if values.dtype.kind in "ui":
+        return values.astype(np.uint64, copy=False)
+    return h3_str_to_int(values)
+
+
+def h3_int_to_cell_str(cells):
+    """uint64 h3 cells to hex strings, "0" for missing as h3.geo_to_h3 returns for NaN coords"""
+    cells = h3_int_to_str(cells)
+    cells[cells == None] = "0"
+    return cells
+
+
+def geo_to_h3_array(lats, lons, h3_resolution):
+    """h3 cells as hex strings -- drop-in for the row-wise h3.geo_to_h3 apply"""
+    return h3_int_to_cell_str(geo_to_h3_int(lats, lons, h3_resolution))
+
+
+def geo_to_h3_multi(lats, lons, h3_resolutions, as_int=False):
+    """h3 cells for several resolutions at once, returns {resolution: cells}"""
+    lats = np.ascontiguousarray(lats, dtype=np.float64)
+    lons = np.ascontiguousarray(lons, dtype=np.float64)
+
+    # every resolution is indexed from the coords -- parents of a fine cell
+    # do not always contain the point, so they would differ from geo_to_h3
+    cells = {}
+    for res in h3_resolutions:
+        res_cells = geo_to_h3_int(lats, lons, res)
+        cells[res] = res_cells if as_int else h3_int_to_cell_str(res_cells)
+    return cells
+
+
+def h3_to_parent_int(cells, parent_resolution):
+    """
+    parents of uint64 h3 cells by bit operations -- resolution field set to
+    parent_resolution, finer digits set to 7 (cells must be at least that fine)
+    """
+    cells = np.asarray(cells, dtype=np.uint64)
+    res_mask = np.uint64(0xF) << np.uint64(52)
+    unused_digits = 0
+    for r in range(parent_resolution + 1, 16):
+        unused_digits |= 7 << ((15 - r) * 3)
+
+    parents = (cells & ~res_mask) | (np.uint64(parent_resolution) << np.uint64(52)) | np.uint64(unused_digits)
+    return np.where(cells == 0, np.uint64(0), parents)
+
@@ -0,0 +1,75 @@
+import pandas as pd
+import geopandas as gpd
+from complexity_engine import complexity_table
+from h3_index import geo_to_h3_int, h3_to_parent_int
+from poi_complexity import selected_cat, min_categories_per_location, min_pois_per_category
+
+
+"""
+location complexity with h3 cells as locations, at several resolutions
+
+POI x category counts are built once at the finest resolution and rolled up
+to coarser ones through parent cells
+"""
+
+
+def hex_counts(poi_data, h3_resolution, category_col=selected_cat):
+    """POI counts per h3 cell (uint64) and category"""
+    points = gpd.GeoSeries(poi_data["geometry"])
+    counts = pd.DataFrame({
+        "h3": geo_to_h3_int(points.y.to_numpy(), points.x.to_numpy(), h3_resolution),
+        category_col: poi_data[category_col].to_numpy(),
+    })
+    counts = counts[counts["h3"] != 0]
+    return counts.groupby(["h3", category_col]).size().rename("poi_count").reset_index()
+
+
+def rollup_counts(counts, parent_resolution, category_col=selected_cat):
+    """counts of parent cells from the counts of their children"""
+    parents = counts.assign(h3=h3_to_parent_int(counts["h3"].to_numpy(), parent_resolution))
+    return parents.groupby(["h3", category_col])["poi_count"].sum().reset_index()
+
+
+def hex_complexity_table(counts, category_col=selected_cat,
+                         min_categories=min_categories_per_location, min_pois=min_pois_per_category):
+    """
+    one row per cell -- eci, diversity, avg_ubiquity and their normalized
+    versions, same filters and measures as the neighborhood level tables
+    """
+    counts = counts.assign(nr_categories=counts.groupby("h3")[category_col].transform("size"))
+    counts = counts[(counts["nr_categories"] >= min_categories) & (counts["poi_count"] >= min_pois)]
+    complexity_df = complexity_table(counts, "h3", category_col, "poi_count")
+
+    cells = complexity_df.groupby("h3").agg(
+        eci=pd.NamedAgg("eci", "first"),
+        diversity=pd.NamedAgg("diversity", "first"),
+        nr_pois=pd.NamedAgg("poi_count", "sum"),
+    )
+    cells["avg_ubiquity"] = complexity_df[complexity_df["rca"] >= 1].groupby("h3")["ubiquity"].mean()
+    cells = cells.reset_index()
+
+    # normalization
+    cells["eci_norm"] = (cells["eci"] - cells["eci"].min()) / (cells["eci"].max() - cells["eci"].min())
+    cells["div_norm"] = (cells["diversity"] - cells["diversity"].min()) / (cells["diversity"].max() - cells["diversity"].min())
+    return cells
+
+
+def multi_resolution_complexity(poi_data, h3_resolutions=(7, 8, 9, 10), category_col=selected_cat,
+                                min_categories=min_categories_per_location, min_pois=min_pois_per_category):
+    """
+    hex complexity for every resolution in one table (h3_resolution, h3, ...),
+    counts are indexed once at the finest resolution and rolled up
+    """
+    h3_resolutions = sorted(h3_resolutions, reverse=True)
+    counts = hex_counts(poi_data, h3_resolutions[0], category_col)
+
+    tables = []
+    for res in h3_resolutions:
+        if res != h3_resolutions[0]:
+            # coarser than the previous level -- roll up the previous counts
+            counts = rollup_counts(counts, res, category_col)
+        table = hex_complexity_table(counts, category_col, min_categories, min_pois)
+        table.insert(0, "h3_resolution", res)
+        tables.append(table)
+
+    return pd.concat(tables, ignore_index=True)
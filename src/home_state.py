@@ -0,0 +1,220 @@
+import numpy as np
+import pandas as pd
+from ub_explorer import prefetch_periods
+from h3_index import geo_to_h3_array
+from instrumentation import record_drop
+
+
+"""
+incremental home detection across months
+
+per device running sums (stops, sum and sum of squares of lon / lat) are kept
+in arrays between periods, so adding a month costs O(rows of the month) --
+monthly homes are the same as ub_explorer.place_of_the_month(..., "home"),
+rolling homes pool the stops of the last `window` months without reading the
+earlier periods again
+
+coordinates are summed as offsets from a per device reference point (its first
+home stop), so the sums of squares keep their precision at home stds of ~0.001
+"""
+
+
+# same thresholds as place_of_the_month
+min_stops = 10
+max_std = 0.001
+
+# columns of the stat arrays
+stat_columns = ["nr_stops", "sum_lon", "sum_lat", "sumsq_lon", "sumsq_lat"]
+
+
+def month_stats(codes, d_lon, d_lat, n):
+    """(n x 5) stats of n devices from the integer device code of every stop"""
+    return np.column_stack([
+        np.bincount(codes, minlength=n).astype(np.float64),
+        np.bincount(codes, d_lon, n),
+        np.bincount(codes, d_lat, n),
+        np.bincount(codes, d_lon * d_lon, n),
+        np.bincount(codes, d_lat * d_lat, n),
+    ])
+
+
+def estimates(stats, ref_lon, ref_lat):
+    """mean and sample std (as pandas std) of lon / lat from summed stats"""
+    n = stats[:, 0]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        mean_lon = stats[:, 1] / n
+        mean_lat = stats[:, 2] / n
+        var_lon = (stats[:, 3] - stats[:, 1] * mean_lon) / (n - 1)
+        var_lat = (stats[:, 4] - stats[:, 2] * mean_lat) / (n - 1)
+    return pd.DataFrame({
+        "mean_lon": ref_lon + mean_lon,
+        "mean_lat": ref_lat + mean_lat,
+        "std_lon": np.sqrt(np.maximum(var_lon, 0)),
+        "std_lat": np.sqrt(np.maximum(var_lat, 0)),
+        "nr_stops": n.astype(np.int64),
+    })
+
+
+def filter_homes(df, h3_resolution, label):
+    """place_of_the_month filters, then the h3 cell of the mean"""
+    rows_before = len(df)
+    df = df[df["nr_stops"] >= min_stops]
+    record_drop(label + ": min 10 stops", rows_before, len(df))
+
+    rows_before = len(df)
+    df = df[(df["std_lon"] <= max_std) & (df["std_lat"] <= max_std)]
+    record_drop(label + ": std threshold", rows_before, len(df))
+
+    df = df.reset_index(drop=True)
+    df["h3"] = geo_to_h3_array(df["mean_lat"].to_numpy(), df["mean_lon"].to_numpy(), h3_resolution)
+    return df
+
+
+class home_state:
+    """
+    array backed per device state of home stops -- one row per device seen so far
+
+    window: number of months pooled in the rolling estimates (None -- all months)
+    """
+
+    def __init__(self, window=3, h3_resolution=10):
+        self.window = window
+        self.h3_resolution = h3_resolution
+        # device_id -> state row, and the ids in row order (in their own dtype)
+        self.rows = {}
+        self.device_ids = []
+        # stat arrays with spare capacity -- rows [0, len(self)) are in use
+        self.ref = np.zeros((0, 2))
+        self.totals = np.zeros((0, len(stat_columns)))
+        self.nr_months = np.zeros(0, dtype=np.int32)
+        # months in the window -- (period, device rows, stats)
+        self.months = []
+
+    def __len__(self):
+        return len(self.device_ids)
+
+    def reserve(self, size):
+        """grow the stat arrays to at least size rows -- capacity doubles, so appends are amortized O(1)"""
+        capacity = len(self.nr_months)
+        if size <= capacity:
+            return
+        capacity = max(size, 2 * capacity, 1024)
+        for name in ["ref", "totals", "nr_months"]:
+            old = getattr(self, name)
+            new = np.zeros((capacity,) + old.shape[1:], dtype=old.dtype)
+            new[:len(old)] = old
+            setattr(self, name, new)
+
+    def positions(self, device_ids):
+        """state rows of (unique) device_ids, new devices appended -- and the mask of new ones"""
+        rows = self.rows
+        pos = np.fromiter((rows.get(d, -1) for d in device_ids), dtype=np.int64, count=len(device_ids))
+        new = pos < 0
+        if new.any():
+            new_ids = device_ids[new].tolist()
+            pos[new] = len(self) + np.arange(len(new_ids))
+            rows.update(zip(new_ids, pos[new].tolist()))
+            self.device_ids.extend(new_ids)
+            self.reserve(len(self))
+        return pos, new
+
+    def add_month(self, period, pos, stats):
+        self.totals[pos] += stats
+        self.nr_months[pos] += 1
+        self.months.append((period, pos, stats))
+
+        # the oldest month leaves the window
+        if self.window is not None and len(self.months) > self.window:
+            _, old_pos, old_stats = self.months.pop(0)
+            self.totals[old_pos] -= old_stats
+            self.nr_months[old_pos] -= 1
+            self.totals[old_pos[self.nr_months[old_pos] == 0]] = 0
+
+    def update(self, stops, period):
+        """
+        add the stops of one month to the state
+        returns the home table of the month (as place_of_the_month)
+        """
+        df = stops[(stops["home__identified"] == 1) & (stops["place_label"] > 0)]
+        codes, devices = pd.factorize(df["device_id"])
+        devices = np.asarray(devices)
+        lons = df["center__lon"].to_numpy(dtype=np.float64)
+        lats = df["center__lat"].to_numpy(dtype=np.float64)
+        pos, new = self.positions(devices)
+
+        # reference point of new devices -- their first home stop
+        first = np.empty(len(devices), dtype=np.int64)
+        first[codes[::-1]] = np.arange(len(codes))[::-1]
+        self.ref[pos[new], 0] = lons[first[new]]
+        self.ref[pos[new], 1] = lats[first[new]]
+
+        ref = self.ref[pos]
+        stats = month_stats(codes, lons - ref[codes, 0], lats - ref[codes, 1], len(devices))
+        self.add_month(period, pos, stats)
+
+        monthly = estimates(stats, ref[:, 0], ref[:, 1])
+        monthly.insert(0, "year_month", period)
+        monthly.insert(0, "device_id", devices)
+        return filter_homes(monthly, self.h3_resolution, "home")
+
+    def rolling_homes(self, min_months=1):
+        """
+        home estimates from the stops of the months in the window
+        min_months: months with home stops a device needs -- home stability
+        """
+        rows = np.flatnonzero(self.nr_months[:len(self)] >= max(min_months, 1))
+        rolling = estimates(self.totals[rows], self.ref[rows, 0], self.ref[rows, 1])
+        rolling.insert(0, "nr_months", self.nr_months[rows])
+        rolling.insert(0, "last_month", self.months[-1][0] if self.months else None)
+        rolling.insert(0, "first_month", self.months[0][0] if self.months else None)
+        rolling.insert(0, "device_id", np.asarray(self.device_ids)[rows])
+        return filter_homes(rolling, self.h3_resolution, "rolling home")
+
+    def save(self, path):
+        """state (with the months of the window) to a .npz file"""
+        np.savez(
+            path,
+            window=np.array(-1 if self.window is None else self.window),
+            h3_resolution=np.array(self.h3_resolution),
+            # numeric ids stay numeric, so a loaded state matches new months
+            device_ids=np.asarray(self.device_ids),
+            ref=self.ref[:len(self)],
+            totals=self.totals[:len(self)],
+            nr_months=self.nr_months[:len(self)],
+            periods=np.array([m[0] for m in self.months], dtype=str),
+            month_sizes=np.array([len(m[1]) for m in self.months], dtype=np.int64),
+            month_pos=np.concatenate([m[1] for m in self.months] or [np.empty(0, dtype=np.int64)]),
+            month_stats=np.concatenate([m[2] for m in self.months] or [np.empty((0, len(stat_columns)))]),
+        )
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as f:
+            window = int(f["window"])
+            state = cls(None if window < 0 else window, int(f["h3_resolution"]))
+            state.device_ids = f["device_ids"].tolist()
+            state.rows = {d: i for i, d in enumerate(state.device_ids)}
+            state.ref = f["ref"]
+            state.totals = f["totals"]
+            state.nr_months = f["nr_months"]
+            bounds = np.cumsum(np.concatenate([[0], f["month_sizes"]]))
+            state.months = [
+                (period, f["month_pos"][a:b], f["month_stats"][a:b])
+                for period, a, b in zip(f["periods"].tolist(), bounds[:-1], bounds[1:])
+            ]
+        return state
+
+
+def incremental_homes(periods, state=None, window=3, h3_resolution=10, min_months=1, max_prefetch=1):
+    """
+    monthly and rolling home tables of each period in one pass over the months
+    state: home_state carried over from earlier periods (e.g. home_state.load)
+    yields (period, monthly homes, rolling homes)
+    """
+    if state is None:
+        state = home_state(window, h3_resolution)
+    columns = ["device_id", "place_label", "center__lon", "center__lat", "home__identified"]
+    for ub in prefetch_periods(periods, max_prefetch, columns=columns):
+        monthly = state.update(ub.data, ub.period)
+        ub.data = None
+        yield ub.period, monthly, state.rolling_homes(min_months)
@@ -0,0 +1,198 @@
+import os
+import json
+import time
+import threading
+import resource
+import functools
+from contextlib import contextmanager
+import pandas as pd
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+
+"""
+stage instrumentation -- wall / cpu time, peak rss of the stage, row counts and rows dropped
+by each filter, exported as json / csv and summarized at the end of a run
+"""
+
+
+# stages currently running in each thread, innermost last -- filters report drops to it
+running = threading.local()
+
+
+def active_stages():
+    if not hasattr(running, "stages"):
+        running.stages = []
+    return running.stages
+
+
+def rss_mb():
+    """current resident memory of the process"""
+    if psutil is not None:
+        return psutil.Process().memory_info().rss / 1024**2
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1024**2
+
+
+def process_peak_rss_mb():
+    """lifetime high-water mark of resident memory (linux reports kB)"""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def reset_peak_rss():
+    """reset the resident memory high-water mark (linux) -- False when not supported"""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def peak_rss_mb():
+    """high-water mark of resident memory since the last reset (VmHWM)"""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return process_peak_rss_mb()
+
+
+# without reset support a stage peak falls back to the rss at its start and end
+can_reset_peak = os.access("/proc/self/clear_refs", os.W_OK)
+
+
+def stage_peak_mb():
+    return peak_rss_mb() if can_reset_peak else rss_mb()
+
+
+# every running stage of every thread -- a reset of the high-water mark is
+# process wide, so the peak so far is folded into all of them first
+running_records = []
+
+
+def fold_peak(records, peak):
+    for r in records:
+        r["peak_rss_mb"] = max(r["peak_rss_mb"] or 0, peak)
+
+
+def record_drop(rule, rows_before, rows_after):
+    """rows dropped by a filter rule, recorded on the innermost running stage"""
+    stages = active_stages()
+    if len(stages) == 0:
+        return
+    drops = stages[-1]["drops"]
+    drop = drops.setdefault(rule, {"rows_before": 0, "rows_after": 0, "dropped": 0})
+    drop["rows_before"] += rows_before
+    drop["rows_after"] += rows_after
+    drop["dropped"] += rows_before - rows_after
+
+
+def records_frame(records):
+    """one row per stage run"""
+    df = pd.DataFrame([{k: v for k, v in r.items() if k != "drops"} for r in records])
+    if len(df) > 0:
+        df["rows_dropped"] = [sum(d["dropped"] for d in r["drops"].values()) for r in records]
+    return df
+
+
+def drops_frame(records):
+    """one row per stage and filter rule"""
+    rows = [
+        {**{k: v for k, v in r.items() if k != "drops"}, "rule": rule, **drop}
+        for r in records
+        for rule, drop in r["drops"].items()
+    ]
+    return pd.DataFrame(rows)
+
+
+def summarize(records):
+    """totals per stage over every run of it"""
+    df = records_frame(records)
+    if len(df) == 0:
+        return df
+    return df.groupby("stage", sort=False).agg(
+        runs=pd.NamedAgg("wall_s", "size"),
+        wall_s=pd.NamedAgg("wall_s", "sum"),
+        cpu_s=pd.NamedAgg("cpu_s", "sum"),
+        peak_rss_mb=pd.NamedAgg("peak_rss_mb", "max"),
+        rows_in=pd.NamedAgg("rows_in", "sum"),
+        rows_out=pd.NamedAgg("rows_out", "sum"),
+        rows_dropped=pd.NamedAgg("rows_dropped", "sum"),
+    ).reset_index()
+
+
+def export_records(records, path_prefix):
+    """<prefix>.json with everything, <prefix>_stages.csv and <prefix>_drops.csv"""
+    os.makedirs(os.path.dirname(path_prefix) or ".", exist_ok=True)
+    with open(path_prefix + ".json", "w") as f:
+        json.dump(records, f, indent=2, default=str)
+    records_frame(records).to_csv(path_prefix + "_stages.csv", index=False)
+    drops_frame(records).to_csv(path_prefix + "_drops.csv", index=False)
+
+
+class stage_recorder:
+    """
+    collects stage records -- context fields (e.g. period) are added to each record
+    """
+
+    def __init__(self, verbose=True, **context):
+        self.records = []
+        self.verbose = verbose
+        self.context = context
+
+    @contextmanager
+    def stage(self, name, rows_in=None):
+        """time a stage -- set record["rows_out"] inside the block"""
+        record = {**self.context, "stage": name, "rows_in": rows_in, "rows_out": None, "drops": {}}
+
+        # peak of this stage only -- the high-water mark is reset at its start
+        fold_peak(running_records, stage_peak_mb())
+        if can_reset_peak:
+            reset_peak_rss()
+        record["peak_rss_mb"] = stage_peak_mb()
+        running_records.append(record)
+        active_stages().append(record)
+        wall_start, cpu_start = time.perf_counter(), time.process_time()
+        try:
+            yield record
+        finally:
+            active_stages().remove(record)
+            running_records.remove(record)
+            record["wall_s"] = round(time.perf_counter() - wall_start, 4)
+            record["cpu_s"] = round(time.process_time() - cpu_start, 4)
+            record["rss_mb"] = round(rss_mb(), 1)
+            fold_peak([record], stage_peak_mb())
+            record["peak_rss_mb"] = round(record["peak_rss_mb"], 1)
+            self.records.append(record)
+            if self.verbose:
+                print(
+                    "%-35s %8.2fs  rows %s -> %s  dropped %s"
+                    % (name, record["wall_s"], record["rows_in"], record["rows_out"],
+                       {rule: d["dropped"] for rule, d in record["drops"].items()})
+                )
+
+    def track(self, name=None):
+        """decorator -- rows in from the first sized argument, rows out from the result"""
+        def decorator(f):
+            @functools.wraps(f)
+            def wrapper(*args, **kwargs):
+                sized = [a for a in args if hasattr(a, "__len__") and not isinstance(a, str)]
+                with self.stage(name or f.__name__, len(sized[0]) if sized else None) as record:
+                    out = f(*args, **kwargs)
+                    record["rows_out"] = len(out) if hasattr(out, "__len__") else None
+                return out
+            return wrapper
+        return decorator
+
+    def summary(self):
+        return summarize(self.records)
+
+    def export(self, path_prefix):
+        export_records(self.records, path_prefix)
@@ -0,0 +1,71 @@
+import numpy as np
+import pandas as pd
+
+
+"""
+home - third place distances and per device mobility features
+"""
+
+
+# same earth radius as the haversine package
+earth_radius_km = 6371.0088
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    """great circle distance in km between coordinate arrays"""
+    lat1, lon1, lat2, lon2 = (np.radians(np.asarray(a, dtype=np.float64)) for a in (lat1, lon1, lat2, lon2))
+    d = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * earth_radius_km * np.arcsin(np.sqrt(d))
+
+
+def third_place_distance(third_df):
+    """home - third place distance from the float columns, no tuple columns"""
+    return haversine_km(
+        third_df["mean_lat_home"].to_numpy(),
+        third_df["mean_lon_home"].to_numpy(),
+        third_df["mean_lat_third"].to_numpy(),
+        third_df["mean_lon_third"].to_numpy(),
+    )
+
+
+def mobility_features(third_df, keys=("device_id", "year_month"), weight_col="nr_visits"):
+    """
+    per device and month -- nr of third places, max / median / visit weighted
+    home distance and visit weighted radius of gyration of the third places
+    """
+    keys = list(keys)
+    w = third_df[weight_col].to_numpy(dtype=np.float64)
+    lat = third_df["mean_lat_third"].to_numpy()
+    lon = third_df["mean_lon_third"].to_numpy()
+    if "distance" in third_df.columns:
+        distance = third_df["distance"].to_numpy()
+    else:
+        distance = third_place_distance(third_df)
+
+    # pass 1 -- visit weighted centroid and distance sums
+    df = third_df[keys].assign(
+        w=w, w_lat=w * lat, w_lon=w * lon, w_distance=w * distance, distance=distance
+    )
+    grouped = df.groupby(keys, observed=True, sort=False)
+    features = grouped.agg(
+        nr_third_places=pd.NamedAgg("distance", "size"),
+        max_distance=pd.NamedAgg("distance", "max"),
+        median_distance=pd.NamedAgg("distance", "median"),
+        w=pd.NamedAgg("w", "sum"),
+        w_lat=pd.NamedAgg("w_lat", "sum"),
+        w_lon=pd.NamedAgg("w_lon", "sum"),
+        w_distance=pd.NamedAgg("w_distance", "sum"),
+    )
+    features["weighted_distance"] = features["w_distance"] / features["w"]
+    centroid_lat = (features["w_lat"] / features["w"]).to_numpy()
+    centroid_lon = (features["w_lon"] / features["w"]).to_numpy()
+
+    # pass 2 -- weighted squared distance of third places from the device centroid
+    group = grouped.ngroup().to_numpy()
+    valid = group >= 0
+    group, w, lat, lon = group[valid], w[valid], lat[valid], lon[valid]
+    d2 = haversine_km(lat, lon, centroid_lat[group], centroid_lon[group]) ** 2
+    rg2 = np.bincount(group, weights=w * d2, minlength=len(features))
+    features["radius_of_gyration"] = np.sqrt(rg2 / features["w"].to_numpy())
+
+    return features.drop(columns=["w", "w_lat", "w_lon", "w_distance"]).reset_index()
@@ -0,0 +1,108 @@
+import os
+import shutil
+import tempfile
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from ub_explorer import ub_explorer
+
+
+"""
+out-of-core home / work / third place tables over many periods
+
+stops are streamed batch by batch and spilled to disk in device_id hash
+buckets, every aggregate groups by device_id, so each bucket is processed
+on its own with the in-memory builder -- a bucket keeps the original row
+order of its devices, so the results are identical to a single pass
+"""
+
+
+def device_buckets(device_ids, n_buckets):
+    """stable hash bucket of each device_id"""
+    return pd.util.hash_array(np.asarray(device_ids)) % n_buckets
+
+
+def spill_by_device(periods, spill_folder, n_buckets, batch_size=1_000_000):
+    """stream the periods' stops into n_buckets parquet files, returns their paths"""
+    paths = [os.path.join(spill_folder, "bucket_%04d.parquet" % b) for b in range(n_buckets)]
+    writers = [None] * n_buckets
+    schema = None
+
+    try:
+        for p in periods:
+            ub = ub_explorer(period=p, load=False)
+            for batch in ub.scanner(batch_size).to_batches():
+                if batch.num_rows == 0:
+                    continue
+                table = pa.Table.from_batches([batch])
+                if schema is None:
+                    schema = table.schema
+                table = table.cast(schema)
+
+                buckets = device_buckets(table.column("device_id").to_pandas(), n_buckets)
+                order = np.argsort(buckets, kind="stable")
+                bounds = np.searchsorted(buckets[order], np.arange(n_buckets + 1))
+                for b in range(n_buckets):
+                    if bounds[b] == bounds[b + 1]:
+                        continue
+                    if writers[b] is None:
+                        writers[b] = pq.ParquetWriter(paths[b], schema)
+                    writers[b].write_table(table.take(order[bounds[b]:bounds[b + 1]]))
+    finally:
+        for w in writers:
+            if w is not None:
+                w.close()
+
+    return [p for p, w in zip(paths, writers) if w is not None]
+
+
+def key_places_tables_out_of_core(periods, h3_resolution, n_buckets=64, spill_folder=None,
+                                  output_folder=None, batch_size=1_000_000):
+    """
+    home, work and third place tables for all periods without holding them in memory
+    same results as ub_explorer.key_places_tables on the concatenated periods;
+    with output_folder the tables are written there per bucket
+    (home / work / third _<bucket>.parquet) and only their paths are returned
+    """
+    own_spill = spill_folder is None
+    if own_spill:
+        spill_folder = tempfile.mkdtemp(prefix="ub_spill_")
+    os.makedirs(spill_folder, exist_ok=True)
+
+    builder = ub_explorer(period=None, load=False)
+    names = ["home", "work", "third"]
+    outputs = {n: [] for n in names}
+
+    try:
+        bucket_paths = spill_by_device(periods, spill_folder, n_buckets, batch_size)
+        for path in bucket_paths:
+            tables = builder.key_places_tables(pd.read_parquet(path), h3_resolution)
+            for n, t in zip(names, tables):
+                if output_folder is None:
+                    outputs[n].append(t)
+                else:
+                    os.makedirs(output_folder, exist_ok=True)
+                    out_path = os.path.join(output_folder, "%s_%s" % (n, os.path.basename(path)))
+                    t.to_parquet(out_path, index=False)
+                    outputs[n].append(out_path)
+            os.remove(path)
+    finally:
+        if own_spill:
+            shutil.rmtree(spill_folder, ignore_errors=True)
+
+    if output_folder is not None:
+        return tuple(outputs[n] for n in names)
+
+    # back to the order of a single grouped pass
+    sort_keys = {
+        "home": ["device_id", "year_month"],
+        "work": ["device_id", "year_month"],
+        "third": ["device_id", "year_month", "place_label"],
+    }
+    return tuple(
+        pd.concat(outputs[n], ignore_index=True)
+        .sort_values(sort_keys[n], kind="stable")
+        .reset_index(drop=True)
+        for n in names
+    )
@@ -0,0 +1,105 @@
+import pandas as pd
+from ub_explorer import ub_explorer, prefetch_periods
+from table_store import write_partition
+from h3_index import as_h3_int
+from mobility_features import third_place_distance, mobility_features
+from instrumentation import stage_recorder, record_drop
+
+
+"""
+monthly home / third place tables -- one stage per period, streamed to disk
+"""
+
+
+def create_period_tables(period, bp_h3, h3_resolution, recorder=None, ub=None):
+    """
+    home, third place (with price groups and distances) and mobility tables for one period
+    ub: already loaded ub_explorer of the period (e.g. from prefetch_periods)
+    """
+    if recorder is None:
+        recorder = stage_recorder(period=period) if ub is None else ub.recorder
+    if ub is None:
+        ub = ub_explorer(period=period, recorder=recorder)
+
+    # create home / work / third place tables in one pass -- uint64 h3, categorical keys
+    with recorder.stage("key_places_tables", len(ub.data)) as record:
+        home_table, _, third_df = ub.key_places_tables(ub.data, h3_resolution, compact=True)
+        record["rows_out"] = len(home_table) + len(third_df)
+    # release the stops of the month -- the caller may still hold ub
+    ub.data = None
+    bp_h3 = bp_h3.assign(h3_polyfill=as_h3_int(bp_h3["h3_polyfill"]))
+
+    # inner merges -- same rows as left merge + dropna, and h3 keys stay uint64
+    with recorder.stage("price_groups", len(home_table) + len(third_df)) as record:
+        # add price group info to HOME
+        rows_before = len(home_table)
+        home_table = pd.merge(
+            home_table, bp_h3, left_on="h3", right_on="h3_polyfill", how="inner"
+        ).dropna(subset="price_group")
+        record_drop("home: no price group", rows_before, len(home_table))
+
+        # add price group to third places
+        rows_before = len(third_df)
+        third_df = pd.merge(
+            third_df, bp_h3, left_on="h3", right_on="h3_polyfill", how="inner"
+        ).dropna(subset="price_group")
+        record_drop("third: no price group", rows_before, len(third_df))
+        record["rows_out"] = len(home_table) + len(third_df)
+
+    with recorder.stage("third_home_join", len(third_df)) as record:
+        # add home price group to third places table
+        rows_before = len(third_df)
+        third_df = pd.merge(
+            third_df,
+            home_table,
+            on=["device_id", "year_month"],
+            how="inner",
+            suffixes=["_third", "_home"],
+        )
+
+        # HUGE drop -- remove stops of users with NO identified home in year_month
+        third_df = third_df.dropna(subset=["h3_polyfill_home"])
+        record_drop("third: no home in year_month", rows_before, len(third_df))
+        record["rows_out"] = len(third_df)
+
+    with recorder.stage("distance_and_mobility", len(third_df)) as record:
+        # distance of third places (km)
+        third_df["distance"] = third_place_distance(third_df)
+
+        # per device mobility features of the month
+        mobility_df = mobility_features(third_df)
+        record["rows_out"] = len(mobility_df)
+
+    return home_table, third_df, mobility_df
+
+
+def run_period(period, bp_h3, h3_resolution, home_root, third_root, mobility_root=None, ub=None):
+    """
+    create and write the tables of one period, nothing is kept in memory
+    returns row counts and the stage records of the period
+    """
+    recorder = stage_recorder(period=period) if ub is None else ub.recorder
+    home_table, third_df, mobility_df = create_period_tables(period, bp_h3, h3_resolution, recorder, ub)
+
+    with recorder.stage("write", len(home_table) + len(third_df)) as record:
+        write_partition(home_table, home_root, period)
+        write_partition(third_df, third_root, period)
+        if mobility_root is not None:
+            write_partition(mobility_df, mobility_root, period)
+        record["rows_out"] = record["rows_in"]
+
+    return {"home_rows": len(home_table), "third_rows": len(third_df), "stages": recorder.records}
+
+
+def run_periods(periods, bp_h3, h3_resolution, home_root, third_root, mobility_root=None,
+                max_prefetch=1):
+    """
+    sequential run over periods, each month is written as soon as it is done
+    the next months are read in the background while the current one is processed
+    """
+    results = {}
+    for ub in prefetch_periods(periods, max_prefetch):
+        results[ub.period] = run_period(
+            ub.period, bp_h3, h3_resolution, home_root, third_root, mobility_root, ub
+        )
+    return results
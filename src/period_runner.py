@@ -0,0 +1,127 @@
+import os
+import json
+import time
+import traceback
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from ub_explorer import stops_file
+from table_store import partition_path
+from period_pipeline import run_period
+from fingerprint import file_fingerprint
+
+
+"""
+parallel, resumable execution of the monthly home / third place stage
+
+every finished period is recorded in a json manifest together with the
+fingerprint of its input file, the stage parameters and its stage records --
+a rerun skips periods that are done and unchanged, and recomputes failed or
+changed ones
+"""
+
+
+# in-memory size of a month of stops relative to its parquet file
+memory_per_file_byte = 8
+
+
+def frame_fingerprint(df):
+    return str(int(pd.util.hash_pandas_object(df, index=False).sum()))
+
+
+def load_manifest(manifest_path):
+    if not os.path.exists(manifest_path):
+        return {}
+    with open(manifest_path) as f:
+        return json.load(f)
+
+
+def save_manifest(manifest, manifest_path):
+    tmp_path = manifest_path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, manifest_path)
+
+
+def period_key(period, params):
+    """what a finished period has to match to be skipped on a rerun"""
+    return {"input": file_fingerprint(stops_file(period)), "params": params}
+
+
+def is_done(manifest, period, key, roots):
+    entry = manifest.get(period)
+    return (
+        entry is not None
+        and entry["status"] == "done"
+        and entry["input"] == key["input"]
+        and entry["params"] == key["params"]
+        and all(os.path.exists(partition_path(root, period)) for root in roots)
+    )
+
+
+def estimated_memory(period):
+    return os.path.getsize(stops_file(period)) * memory_per_file_byte
+
+
+def run_periods_parallel(periods, bp_h3, h3_resolution, home_root, third_root,
+                         n_workers=4, memory_budget_gb=None, manifest_path=None,
+                         mobility_root=None):
+    """
+    run the monthly stage over a process pool
+
+    at most n_workers periods run at once, and while more than one runs their
+    estimated memory stays below memory_budget_gb
+    returns the manifest entries of this run's periods
+    """
+    if manifest_path is None:
+        manifest_path = os.path.join(third_root, "_manifest.json")
+    os.makedirs(os.path.dirname(manifest_path) or ".", exist_ok=True)
+    manifest = load_manifest(manifest_path)
+
+    params = {"h3_resolution": h3_resolution, "bp_h3": frame_fingerprint(bp_h3)}
+    # a missing / unreadable stops file fails its own period, not the run
+    keys = {}
+    memory = {}
+    for p in periods:
+        try:
+            keys[p] = period_key(p, params)
+            memory[p] = estimated_memory(p)
+        except OSError:
+            manifest[p] = {"status": "failed", "error": traceback.format_exc(), "finished": time.time()}
+            print(" ", p, "failed")
+    save_manifest(manifest, manifest_path)
+
+    roots = [r for r in [home_root, third_root, mobility_root] if r is not None]
+    todo = [p for p in periods if p in keys and not is_done(manifest, p, keys[p], roots)]
+    print("Periods done:", len(periods) - len(todo) - (len(periods) - len(keys)),
+          "failed:", len(periods) - len(keys), "to run:", len(todo))
+
+    budget = None if memory_budget_gb is None else memory_budget_gb * 1024**3
+
+    with ProcessPoolExecutor(max_workers=n_workers) as pool:
+        running = {}
+        while todo or running:
+            # submit while workers and memory budget allow -- always keep one running
+            while todo and len(running) < n_workers:
+                in_use = sum(memory[p] for p in running.values())
+                if running and budget is not None and in_use + memory[todo[0]] > budget:
+                    break
+                p = todo.pop(0)
+                future = pool.submit(
+                    run_period, p, bp_h3, h3_resolution, home_root, third_root, mobility_root
+                )
+                running[future] = p
+                manifest[p] = {"status": "running", "started": time.time(), **keys[p]}
+
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                p = running.pop(future)
+                entry = manifest[p]
+                try:
+                    entry.update(status="done", **future.result())
+                except Exception:
+                    entry.update(status="failed", error=traceback.format_exc())
+                entry["finished"] = time.time()
+                print(" ", p, entry["status"])
+            save_manifest(manifest, manifest_path)
+
+    return {p: manifest[p] for p in periods}
@@ -2,7 +2,11 @@ import numpy as np
 import pandas as pd
 import geopandas as gpd
 import h3
-from ecomplexity import ecomplexity
+from complexity_engine import complexity_table
+from stage_cache import stage_cache
+from instrumentation import stage_recorder, record_drop
+from fingerprint import file_fingerprint, key_hash, code_fingerprint
+from geo_ingest import read_geo
 
 
 """
@@ -13,111 +17,334 @@ complexity of locations and pois in Budapest
 # parameters
 path_location_file = "../data/shape_files/neighborhoods_admin10.shp"
 path_poi_file = "../data/google_pois_2021_enriched.geojson"
+path_cache_folder = "../data/cache/"
+cache_size_gb = 5
 selected_cat = "category_78"
+poi_columns = ["place_id", "name", "amenity_category", "mall", selected_cat]
 filter_out = ["ATM", "Parking"]
 min_categories_per_location = 2
 min_pois_per_category = 2
 
 
+def lazy_stage(stage):
+    """attribute computed on first access (with its dependencies) and memoized"""
+    return property(
+        lambda self: self.get(stage),
+        lambda self, value: self.set(stage, value),
+        doc=stage + " -- computed on first access"
+    )
+
+
 class poi_complexity:
     """
     class to create location / poi category table with complexity related variables
-    """
-
-    def __init__(self):
-        print("Preparing location data.. ", end="")
-        self.location_data = self.prep_location_data()
-        print(" location_data READY")
-
-        print("Preparing POI data.. ", end="")
-        self.raw_poi_data = self.prep_poi_data()
-        print(" raw_poi_data READY")
 
-        print("Cleaning POI data.. ", end="")
-        self.poi_data = self.filter_poi_data(self.raw_poi_data, filter_out)
-        print(" FILTERED for", filter_out)
-
-        print("ADD location to POIs.. ", end="")
-        self.poi_data = self.pois_locations(self.poi_data, self.location_data)
-        print(" poi_data READY")
+    outputs are evaluated lazily -- each attribute is computed on first access,
+    together with the stages it depends on, and memoized (and cached on disk)
+    """
 
-        print("Preparing aggregated location category table..", end="")
-        self.category_location_table = self.filter_category_location_table(
-            self.create_category_location_table(self.poi_data, selected_cat),
-            min_categories_per_location,
-            min_pois_per_category
+    # stage graph -- output: (dependencies, compute)
+    stages = {
+        "location_data": (
+            [],
+            lambda self: self.prep_location_data()
+        ),
+        "raw_poi_data": (
+            [],
+            lambda self: self.prep_poi_data()
+        ),
+        # filtered for filter_out, with locations
+        "poi_data": (
+            ["raw_poi_data", "location_data"],
+            lambda self: self.pois_locations(
+                self.filter_poi_data(self.raw_poi_data, filter_out),
+                self.location_data
+            )
+        ),
+        # all counts, before the threshold filters
+        "category_location_counts": (
+            ["poi_data"],
+            lambda self: self.create_category_location_table(self.poi_data, selected_cat)
+        ),
+        "category_location_table": (
+            ["category_location_counts"],
+            lambda self: self.filter_category_location_table(
+                self.category_location_counts,
+                min_categories_per_location,
+                min_pois_per_category
+            )
+        ),
+        "complexity_df": (
+            ["category_location_table"],
+            lambda self: self.create_complexity_df(self.category_location_table)
+        ),
+        "location_complexity": (
+            ["location_data", "complexity_df"],
+            lambda self: self.create_location_complexity_table(self.location_data, self.complexity_df)
+        ),
+        "poi_complexity": (
+            ["complexity_df"],
+            lambda self: self.create_poi_complexity_table(self.complexity_df)
+        ),
+    }
+
+    # sources are cached by geo_ingest on the same stage cache -- not stored twice
+    source_stages = ["location_data", "raw_poi_data"]
+
+    location_data = lazy_stage("location_data")
+    raw_poi_data = lazy_stage("raw_poi_data")
+    poi_data = lazy_stage("poi_data")
+    category_location_counts = lazy_stage("category_location_counts")
+    category_location_table = lazy_stage("category_location_table")
+    complexity_df = lazy_stage("complexity_df")
+    location_complexity = lazy_stage("location_complexity")
+    poi_complexity = lazy_stage("poi_complexity")
+
+    def __init__(self, use_cache=True, recorder=None, poi_columns=poi_columns):
+        # raw POI columns to read -- add category columns other than selected_cat here
+        self.poi_columns = list(dict.fromkeys(poi_columns))
+        self.cache = stage_cache(path_cache_folder, cache_size_gb) if use_cache else None
+        self.recorder = recorder if recorder is not None else stage_recorder()
+        self.outputs = {}
+        # stages set by assignment -- never written to the disk cache
+        self.assigned = set()
+        self.keys = None
+        # last ECI / PCI eigenvector -- warm start for incremental updates
+        self.eigenvector = None
+
+    def get(self, stage):
+        """output of a stage -- memoized, from the disk cache, or computed after its dependencies"""
+        if stage in self.outputs:
+            return self.outputs[stage]
+
+        dependencies, compute = self.stages[stage]
+        if self.keys is None:
+            self.keys = self.stage_keys()
+        key = self.keys[stage]
+
+        # on a cache hit the dependencies are not needed at all; outputs derived
+        # from an assigned stage do not match the input files, so never stored
+        stored = (
+            self.cache is not None
+            and stage not in self.source_stages
+            and not (self.upstream(stage) | {stage}) & self.assigned
+        )
+        cached = stored and self.cache.find(stage, key)[0] is not None
+        if not cached:
+            for d in dependencies:
+                self.get(d)
+
+        with self.recorder.stage(stage) as record:
+            if cached:
+                out = self.cache.get(stage, key)
+                if stage == "complexity_df":
+                    self.eigenvector = self.cached_eigenvector(key)
+            else:
+                out = compute(self)
+                if stored:
+                    self.cache.put(stage, key, out)
+                    if stage == "complexity_df" and self.eigenvector is not None:
+                        self.cache.put(
+                            "complexity_eigenvector", key,
+                            pd.DataFrame({"category": self.eigenvector.index, "v": self.eigenvector.to_numpy()})
+                        )
+                if len(dependencies) > 0:
+                    record["rows_in"] = len(self.outputs[dependencies[0]])
+            record["rows_out"] = len(out)
+
+        self.outputs[stage] = out
+        return out
+
+    def cached_eigenvector(self, key):
+        """
+        eigenvector stored with a cached complexity_df -- warm start for update_pois;
+        recomputed from category_location_table when it was evicted
+        """
+        stored = self.cache.get("complexity_eigenvector", key)
+        if stored is not None:
+            return stored.set_index("category")["v"]
+        self.create_complexity_df(self.category_location_table)
+        return self.eigenvector
+
+    def upstream(self, stage):
+        """every stage the output of stage depends on"""
+        stages = set()
+        for d in self.stages[stage][0]:
+            stages |= {d} | self.upstream(d)
+        return stages
+
+    def set(self, stage, value):
+        """
+        assign a stage output -- it no longer matches the input files, so the
+        disk cache is switched off and memoized outputs depending on it dropped
+        """
+        self.cache = None
+        self.assigned.add(stage)
+        for s in self.stages:
+            if stage in self.upstream(s):
+                self.outputs.pop(s, None)
+        self.outputs[stage] = value
+
+    def update_pois(self, added=None, removed=None, changed=None):
+        """
+        incremental refresh for a POI diff instead of a full rebuild
+        added / changed: POIs with the raw data columns, removed: place_ids
+        only the affected count cells change, the thresholds are reapplied and
+        ECI / PCI are warm started from the previous eigenvector
+        """
+        new_pois = [df for df in [added, changed] if df is not None and len(df) > 0]
+        new_pois = pd.concat(new_pois, ignore_index=True) if new_pois else None
+        outgoing_ids = set(removed if removed is not None else [])
+        if changed is not None:
+            outgoing_ids |= set(changed["place_id"])
+
+        with self.recorder.stage("update_pois") as record:
+            poi_data = self.poi_data
+            raw_poi_data = self.raw_poi_data
+            counts = self.category_location_counts
+
+            # POIs leaving / entering the filtered, located POI table
+            outgoing = poi_data["place_id"].isin(outgoing_ids)
+            incoming = None
+            if new_pois is not None:
+                incoming = self.pois_locations(
+                    self.filter_poi_data(new_pois, filter_out),
+                    self.location_data
+                )
+
+            delta = [poi_data.loc[outgoing, ["location_name", selected_cat]].assign(delta=-1)]
+            if incoming is not None:
+                delta.append(incoming[["location_name", selected_cat]].assign(delta=1))
+            delta = pd.concat(delta).groupby(["location_name", selected_cat])["delta"].sum()
+
+            counts = self.apply_count_delta(counts, delta, selected_cat)
+            poi_data = pd.concat([poi_data[~outgoing]] + ([incoming] if incoming is not None else []))
+            raw_poi_data = pd.concat(
+                [raw_poi_data[~raw_poi_data["place_id"].isin(outgoing_ids)]]
+                + ([new_pois] if new_pois is not None else [])
             )
-        print(" category_location_table READY")
-
-        print("Measuring complexity.. ", end="")
-        self.complexity_df = self.create_complexity_df(self.category_location_table)
-        print(" complexity_df READY")
-
-        print("Creating location complexity table.. ", end="")
-        self.location_complexity = self.create_location_complexity_table(self.location_data, self.complexity_df)
-        print(" location_complexity READY")
 
-        print("Creating POI complexity table.. ", end="")
-        self.poi_complexity = self.create_poi_complexity_table(self.complexity_df)
-        print(" poi_complexity READY")
+            table = self.filter_category_location_table(
+                counts, min_categories_per_location, min_pois_per_category
+            )
+            complexity_df = self.create_complexity_df(table, v0=self.eigenvector)
+            record["rows_in"] = len(delta)
+            record["rows_out"] = len(complexity_df)
+
+        # outputs no longer match the input files -- no disk cache from here on
+        self.cache = None
+        self.outputs = {
+            "location_data": self.location_data,
+            "raw_poi_data": raw_poi_data,
+            "poi_data": poi_data,
+            "category_location_counts": counts,
+            "category_location_table": table,
+            "complexity_df": complexity_df,
+        }
+        return self
+
+    def apply_count_delta(self, counts, delta, category_col=selected_cat):
+        """add (location, category) count changes, drop emptied cells, redo nr_categories"""
+        keys = ["location_name", category_col]
+        poi_count = counts.set_index(keys)["poi_count"].add(delta, fill_value=0)
+        poi_count = poi_count[poi_count > 0].astype(int)
+
+        counts = poi_count.rename("poi_count").reset_index().sort_values(keys)
+        counts.insert(2, "nr_categories", counts.groupby("location_name")[category_col].transform("size"))
+        return counts.reset_index(drop=True)
+
+    def compute_all(self):
+        """evaluate every output -- the former eager construction"""
+        for stage in self.stages:
+            self.get(stage)
+        return self
+
+    def stage_keys(self):
+        """cache keys -- input file fingerprints and parameters, chained along the stages"""
+        keys = {}
+        keys["location_data"] = key_hash("location_data", file_fingerprint(path_location_file))
+        keys["raw_poi_data"] = key_hash("raw_poi_data", file_fingerprint(path_poi_file), self.poi_columns)
+        keys["poi_data"] = key_hash(
+            "poi_data", keys["raw_poi_data"], keys["location_data"], sorted(filter_out),
+            selected_cat, self.filter_rules_key()
+        )
+        keys["category_location_counts"] = key_hash(
+            "category_location_counts", keys["poi_data"], selected_cat
+        )
+        keys["category_location_table"] = key_hash(
+            "category_location_table", keys["category_location_counts"],
+            min_categories_per_location, min_pois_per_category
+        )
+        keys["complexity_df"] = key_hash("complexity_df", keys["category_location_table"])
+        keys["location_complexity"] = key_hash(
+            "location_complexity", keys["location_data"], keys["complexity_df"]
+        )
+        keys["poi_complexity"] = key_hash("poi_complexity", keys["complexity_df"])
+        return keys
+
+
+    def filter_rules_key(self):
+        """the filter rule definitions -- a changed rule invalidates poi_data and everything after it"""
+        return key_hash(
+            sorted((name, code_fingerprint(rule)) for name, rule in self.filter_rules.items()),
+            sorted(
+                (name, code_fingerprint(rule), category)
+                for name, (rule, category) in self.recategorize_rules.items()
+            ),
+            code_fingerprint(self.filter_poi_data),
+        )
 
 
     # data prep functions
     def prep_location_data(self):
-        locations = gpd.read_file(path_location_file)
+        locations = read_geo(path_location_file, cache=self.cache)
         locations = locations.set_geometry("geometry")
         locations = locations.to_crs("epsg:4326")
         return locations
 
     def prep_poi_data(self):
-        raw_poi_data = gpd.read_file(path_poi_file)
+        # only the columns used by the pipeline
+        raw_poi_data = read_geo(path_poi_file, self.poi_columns, cache=self.cache)
         return raw_poi_data
 
 
-    # poi filters
-    def remove_atm(self, df):
-        filtered = df[(df["amenity_category"] != "ATM") & ~(df["name"]).str.contains(" ATM ", case=False)]
-        return filtered
-
-    def remove_parking(self, df):
-        filtered = df[df["amenity_category"] != "Parking"]
-        return filtered
-
-    def remove_malls(self, df):
-        filtered = df[df["mall"].isna()]
-        return filtered
-
-    def mask_inside_malls_pois(self, df):
-        df.loc[df["mall"].isna()==False, selected_cat] = "shopping mall"
-        filtered = df
-        return filtered
-
-    def filter_poi_data(self, df, filter_list):
+    # poi filters -- rules apply when a filter_list entry contains their name
+    # drop rules: name -> rows to drop
+    filter_rules = {
+        "ATM": lambda df: (
+            (df["amenity_category"] == "ATM").to_numpy()
+            | df["name"].str.upper().str.contains(" ATM ", regex=False, na=False).to_numpy()
+        ),
+        "Parking": lambda df: (df["amenity_category"] == "Parking").to_numpy(),
+        "mall": lambda df: df["mall"].notna().to_numpy(),
+    }
+    # recategorization rules: name -> (rows to recategorize, new category)
+    recategorize_rules = {
+        "mask": (lambda df: df["mall"].notna().to_numpy(), "shopping mall"),
+    }
+
+    def filter_poi_data(self, df, filter_list, category_col=selected_cat):
         """
-        combine previously defined filters
+        combine the filter rules into one boolean mask and one recategorization
+        pass -- the input is not modified, a single filtered copy is returned
         """
-        filtered = df
-        
-        if any("ATM" in p for p in filter_list):
-            filtered = self.remove_atm(filtered)
-        else:
-            filtered = filtered
-
-        if any("Parking" in p for p in filter_list):
-            filtered = self.remove_parking(filtered)
-        else:
-            filtered
-
-        if any("mall" in p for p in filter_list):
-            filtered = self.remove_malls(filtered)
-        else:
-            filtered
-
-        if any("mask" in m for m in filter_list):
-            filtered = self.mask_inside_malls_pois(filtered)
-        else:
-            filtered
-
+        keep = np.ones(len(df), dtype=bool)
+        for name, rule in self.filter_rules.items():
+            if any(name in p for p in filter_list):
+                rows_before = int(keep.sum())
+                keep &= ~rule(df)
+                record_drop(name, rows_before, int(keep.sum()))
+
+        categories = None
+        for name, (rule, category) in self.recategorize_rules.items():
+            if any(name in p for p in filter_list):
+                if categories is None:
+                    categories = df[category_col].to_numpy(dtype=object, copy=True)
+                categories[rule(df)] = category
+
+        filtered = df.take(np.flatnonzero(keep))
+        if categories is not None:
+            filtered[category_col] = categories[keep]
         return filtered
 
 
@@ -134,8 +361,8 @@ class poi_complexity:
 
     # create aggregate category location table
     def create_category_location_table(self, df, category_col):
-        # create vars for future filter
-        df["nr_categories"] = df.groupby(["location_name"])[category_col].transform("nunique")
+        # create vars for future filter -- on a copy, the cached poi_data stays as stored
+        df = df.assign(nr_categories=df.groupby(["location_name"])[category_col].transform("nunique"))
 
         # POI category - area - count table
         cat_location_table = df.groupby(["location_name", category_col, "nr_categories"]).agg(
@@ -144,23 +371,21 @@ class poi_complexity:
         return cat_location_table
 
     def filter_category_location_table(self, df, min_categories, min_pois):
+        rows_before = len(df)
         df = df[df["nr_categories"] >= min_categories]
+        record_drop("min_categories_per_location", rows_before, len(df))
+
+        rows_before = len(df)
         df = df[df["poi_count"] >= min_pois]
+        record_drop("min_pois_per_category", rows_before, len(df))
         return df
     
 
-    # measure complexity -- thanks Growth Lab
-    def create_complexity_df(self, df):
-        df["year"] = 2020
-        
-        key_cols = {
-            "time" : "year",
-            "loc" : "location_name",
-            "prod" : selected_cat,
-            "val" : "poi_count"
-        }
-
-        complexity_df = ecomplexity(df, key_cols)
+    # measure complexity -- sparse version of the Growth Lab ecomplexity measures
+    def create_complexity_df(self, df, category_col=selected_cat, v0=None):
+        complexity_df, self.eigenvector = complexity_table(
+            df, "location_name", category_col, "poi_count", v0=v0, return_eigenvector=True
+        )
         return complexity_df
 
     def create_location_complexity_table(self, location_data, complexity_data):
@@ -189,8 +414,8 @@ class poi_complexity:
         location_complexity["div_norm"] = (location_complexity["diversity"] - location_complexity["diversity"].min()) / (location_complexity["diversity"].max() - location_complexity["diversity"].min())
         return location_complexity
 
-    def create_poi_complexity_table(self, complexity_data):
-        poi_complexity = complexity_data[[selected_cat, "pci", "ubiquity"]].drop_duplicates()
+    def create_poi_complexity_table(self, complexity_data, category_col=selected_cat):
+        poi_complexity = complexity_data[[category_col, "pci", "ubiquity"]].drop_duplicates()
 
         # normalization
         poi_complexity["ubi_norm"] = (poi_complexity["ubiquity"] - poi_complexity["ubiquity"].min()) / (poi_complexity["ubiquity"].max() - poi_complexity["ubiquity"].min())        
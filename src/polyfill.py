@@ -0,0 +1,146 @@
+import os
+import hashlib
+import warnings
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import h3
+import shapely
+from shapely.geometry import Polygon, mapping
+from h3_index import as_h3_int, h3_int_to_str
+
+
+"""
+polygon -> h3 cell filling with bulk hex geometries and an on-disk cache
+"""
+
+
+def hex_boundaries(cells):
+    """
+    hex polygons for h3 cells (hex strings or uint64) as a GeoSeries -- the h3
+    boundary is looked up once per distinct cell, the polygons are built in bulk
+    """
+    unique, inverse = np.unique(as_h3_int(cells), return_inverse=True)
+    unique_names = h3_int_to_str(unique)
+    polygons = np.empty(len(unique_names), dtype=object)
+    valid = np.flatnonzero([c is not None for c in unique_names])
+    rings = [h3.h3_to_geo_boundary(unique_names[i], True) for i in valid]
+
+    if hasattr(shapely, "polygons"):
+        # shapely 2 -- one call per ring length (pentagons have 5 vertices)
+        lengths = np.array([len(r) for r in rings], dtype=int)
+        for n in np.unique(lengths):
+            idx = np.flatnonzero(lengths == n)
+            polygons[valid[idx]] = shapely.polygons(np.array([rings[i] for i in idx]))
+    else:
+        for i, ring in zip(valid, rings):
+            polygons[i] = Polygon(ring)
+
+    return gpd.GeoSeries(polygons[inverse.ravel()], crs="epsg:4326")
+
+
+def small_polygon_cell(geometry, h3_resolution):
+    """cell of an inside point -- for polygons smaller than a hex"""
+    point = geometry.representative_point()
+    return h3.geo_to_h3(point.y, point.x, h3_resolution)
+
+
+def polygon_cells(geometry, h3_resolution, fill_small=True):
+    """h3 cells with their center inside the (multi)polygon"""
+    cells = set()
+    for part in getattr(geometry, "geoms", [geometry]):
+        cells |= h3.polyfill(mapping(part), h3_resolution, geo_json_conformant=True)
+
+    # polygons smaller than a hex -- the cell of an inside point
+    if fill_small and len(cells) == 0 and not geometry.is_empty:
+        cells = {small_polygon_cell(geometry, h3_resolution)}
+    return sorted(cells)
+
+
+def geometry_key(gdf, h3_resolution, fill_small):
+    """content key of a polygon set -- same geometries give the same cell table"""
+    digest = hashlib.sha1()
+    for wkb in gdf.geometry.to_wkb():
+        digest.update(wkb)
+    digest.update(repr((h3_resolution, fill_small, "one owner per cell")).encode())
+    return digest.hexdigest()[:16]
+
+
+def polyfill_cells(gdf, h3_resolution, fill_small=True):
+    """
+    polygon -> cell table -- row (position in gdf) and h3_polyfill
+
+    cells are assigned by center, so non-overlapping polygons never share one;
+    a polygon smaller than a hex (fill_small) gets the cell of an inside point
+    only when no other polygon owns that cell already
+    """
+    rows = []
+    cells = []
+    small = []
+    for i, geometry in enumerate(gdf.geometry):
+        if geometry is None:
+            continue
+        part_cells = polygon_cells(geometry, h3_resolution, fill_small=False)
+        if len(part_cells) == 0:
+            if fill_small and not geometry.is_empty:
+                small.append((i, geometry))
+            continue
+        rows.extend([i] * len(part_cells))
+        cells.extend(part_cells)
+
+    owned = set(cells)
+    for i, geometry in small:
+        cell = small_polygon_cell(geometry, h3_resolution)
+        if cell not in owned:
+            owned.add(cell)
+            rows.append(i)
+            cells.append(cell)
+
+    return pd.DataFrame({"row": np.array(rows, dtype=np.int64), "h3_polyfill": cells})
+
+
+def unique_cells(df, cell_col="h3_polyfill"):
+    """
+    one row per cell before a cell table is joined on it -- overlapping polygons
+    or duplicated rows share cells, the first row of each cell is kept (with a warning)
+    """
+    duplicated = df[cell_col].duplicated()
+    if duplicated.any():
+        warnings.warn(
+            "%d rows share an %s cell with an earlier row -- keeping the first row per cell"
+            % (duplicated.sum(), cell_col)
+        )
+        df = df[~duplicated]
+    return df
+
+
+def polyfill(gdf, h3_resolution, cache_folder=None, fill_small=True):
+    """
+    one row per polygon and h3 cell, like gdf.h3.polyfill(h3_resolution, explode=True)
+    but without NA rows for small polygons (fill_small), and every cell belongs
+    to one polygon -- the cell table is
+    persisted per polygon set and resolution when cache_folder is given
+    """
+    cell_table = None
+    if cache_folder is not None:
+        path = os.path.join(cache_folder, "polyfill_%d_%s.parquet" % (h3_resolution, geometry_key(gdf, h3_resolution, fill_small)))
+        if os.path.exists(path):
+            cell_table = pd.read_parquet(path)
+
+    if cell_table is None:
+        cell_table = polyfill_cells(gdf, h3_resolution, fill_small)
+        if cache_folder is not None:
+            os.makedirs(cache_folder, exist_ok=True)
+            cell_table.to_parquet(path + ".tmp", index=False)
+            os.replace(path + ".tmp", path)
+
+    filled = gdf.iloc[cell_table["row"].to_numpy()].copy()
+    filled["h3_polyfill"] = cell_table["h3_polyfill"].to_numpy()
+    return filled
+
+
+def add_hex_geometry(df, cell_col="h3_polyfill", geometry_col="geometry_hex"):
+    """hex polygon column for the cells, set as the active geometry"""
+    df = gpd.GeoDataFrame(df)
+    df[geometry_col] = hex_boundaries(df[cell_col]).to_numpy()
+    return df.set_geometry(geometry_col, crs="epsg:4326")
@@ -0,0 +1,196 @@
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from concurrent.futures import ProcessPoolExecutor
+from complexity_engine import rca_values, mcp_matrix, eci_pci
+from poi_complexity import selected_cat, min_categories_per_location, min_pois_per_category
+
+
+"""
+uncertainty of ECI / PCI -- POI bootstrap and a degree preserving null model
+
+bootstrap: POIs resampled with replacement
+null model: categories shuffled across POIs, which keeps the number of POIs of
+every location and every category, i.e. the weighted degrees of the
+location x category matrix
+randomizations are drawn and solved in vectorized batches (one batched eigh
+for up to 1000 categories) over a process pool
+"""
+
+
+def threshold_counts(counts, min_categories, min_pois):
+    """same filters as filter_category_location_table, on a csr count matrix"""
+    nr_categories = np.diff(counts.indptr)
+    counts = sparse.diags((nr_categories >= min_categories).astype(np.float64)) @ counts
+    counts = counts.tocsr()
+    counts.data[counts.data < min_pois] = 0
+    counts.eliminate_zeros()
+    return counts
+
+
+def solve_counts(loc_codes, cat_codes, shape, min_categories, min_pois):
+    """eci / pci of one POI set given as location and category codes"""
+    counts = sparse.csr_matrix(
+        (np.ones(len(loc_codes)), (loc_codes, cat_codes)), shape=shape
+    )
+    counts.sum_duplicates()
+    counts = threshold_counts(counts, min_categories, min_pois)
+    if counts.nnz == 0:
+        return np.full(shape[0], np.nan), np.full(shape[1], np.nan)
+
+    coo, rca = rca_values(counts)
+    eci, pci, _ = eci_pci(mcp_matrix(coo, rca))
+    return eci, pci
+
+
+def masked_mean(x, mask):
+    """row means of x over the masked entries of each row"""
+    return np.where(mask, x, 0).sum(axis=1, keepdims=True) / mask.sum(axis=1, keepdims=True)
+
+
+def batch_complexity(counts, min_categories, min_pois):
+    """
+    eci / pci of a stack of dense (batch x locations x categories) count matrices --
+    the measures of eci_pci, with one batched eigh over the stacked A'A matrices
+    locations / categories without presence get zero rows / columns, so they
+    only add zero eigenvalues below the second largest one
+    """
+    counts = counts * (np.count_nonzero(counts, axis=2) >= min_categories)[:, :, None]
+    counts[counts < min_pois] = 0
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        loc_total = counts.sum(axis=2, keepdims=True)
+        prod_total = counts.sum(axis=1, keepdims=True)
+        total = counts.sum(axis=(1, 2), keepdims=True)
+        rca = (counts / loc_total) / (prod_total / total)
+        mcp = ((counts > 0) & (rca >= 1)).astype(np.float64)
+
+        diversity = mcp.sum(axis=2)
+        ubiquity = mcp.sum(axis=1)
+        loc_ok = diversity > 0
+        prod_ok = ubiquity > 0
+        kc_inv = np.where(loc_ok, 1 / diversity, 0)
+        kp_sqrt_inv = np.where(prod_ok, 1 / np.sqrt(ubiquity), 0)
+
+        a = mcp * np.sqrt(kc_inv)[:, :, None] * kp_sqrt_inv[:, None, :]
+        _, eigvecs = np.linalg.eigh(a.transpose(0, 2, 1) @ a)
+        v = eigvecs[:, :, -2]
+
+        # back to the eigenvector of Mpp, then the location side
+        kp = kp_sqrt_inv * v
+        kc = kc_inv * np.einsum("blc,bc->bl", mcp, kp)
+
+        # sign so that ECI correlates positively with diversity
+        cov = masked_mean(
+            (diversity - masked_mean(diversity, loc_ok)) * (kc - masked_mean(kc, loc_ok)), loc_ok
+        )
+        sign = np.where(cov < 0, -1, 1)
+        kc = sign * kc
+        kp = sign * kp
+
+        # normalization as in ecomplexity / STATA
+        eci_mean = masked_mean(kc, loc_ok)
+        eci_std = np.sqrt(masked_mean((kc - eci_mean) ** 2, loc_ok))
+        eci = np.where(loc_ok, (kc - eci_mean) / eci_std, np.nan)
+        pci = np.where(prod_ok, (kp - eci_mean) / eci_std, np.nan)
+
+    # fewer than two present categories -- no second eigenvector, as in eci_pci
+    unsolved = prod_ok.sum(axis=1) < 2
+    eci[unsolved] = np.nan
+    pci[unsolved] = np.nan
+    return eci, pci
+
+
+def run_batch(kind, batch_seed, batch_size, loc_codes, cat_codes, shape, min_categories, min_pois,
+              dense_limit=1000):
+    """one batch of randomizations -- (batch_size x locations) eci, (batch_size x categories) pci"""
+    rng = np.random.default_rng(batch_seed)
+    n = len(loc_codes)
+
+    # draw the whole batch at once
+    if kind == "bootstrap":
+        idx = rng.integers(0, n, size=(batch_size, n))
+        locs, cats = loc_codes[idx], cat_codes[idx]
+    else:
+        locs = np.broadcast_to(loc_codes, (batch_size, n))
+        cats = rng.permuted(np.tile(cat_codes, (batch_size, 1)), axis=1)
+
+    if shape[1] > dense_limit:
+        # large category sets -- sparse solve draw by draw
+        eci = np.empty((batch_size, shape[0]))
+        pci = np.empty((batch_size, shape[1]))
+        for b in range(batch_size):
+            eci[b], pci[b] = solve_counts(locs[b], cats[b], shape, min_categories, min_pois)
+        return eci, pci
+
+    # dense count matrices of the whole batch from one bincount
+    cells = shape[0] * shape[1]
+    flat = np.arange(batch_size)[:, None] * cells + locs * shape[1] + cats
+    counts = np.bincount(flat.ravel(), minlength=batch_size * cells)
+    return batch_complexity(counts.reshape(batch_size, *shape).astype(np.float64), min_categories, min_pois)
+
+
+def randomized_complexity(kind, n_draws, loc_codes, cat_codes, shape, min_categories, min_pois,
+                          batch_size=20, n_workers=1, seed=0):
+    """eci / pci of n_draws randomizations, stacked by draw"""
+    n_batches = -(-n_draws // batch_size)
+    sizes = [min(batch_size, n_draws - b * batch_size) for b in range(n_batches)]
+    kind_id = 0 if kind == "bootstrap" else 1
+    args = [
+        (kind, [seed, kind_id, b], sizes[b], loc_codes, cat_codes, shape, min_categories, min_pois)
+        for b in range(n_batches)
+    ]
+
+    if n_workers > 1:
+        with ProcessPoolExecutor(max_workers=n_workers) as pool:
+            results = list(pool.map(run_batch, *zip(*args)))
+    else:
+        results = [run_batch(*a) for a in args]
+
+    return np.vstack([r[0] for r in results]), np.vstack([r[1] for r in results])
+
+
+def summary_table(names, name_col, measure, observed, boot, null, ci):
+    """observed value, bootstrap mean / std / interval, null mean / std and z-score"""
+    alpha = (1 - ci) / 2
+    null_mean = np.nanmean(null, axis=0)
+    null_std = np.nanstd(null, axis=0)
+    return pd.DataFrame({
+        name_col: names,
+        measure: observed,
+        measure + "_boot_mean": np.nanmean(boot, axis=0),
+        measure + "_boot_std": np.nanstd(boot, axis=0),
+        measure + "_ci_low": np.nanquantile(boot, alpha, axis=0),
+        measure + "_ci_high": np.nanquantile(boot, 1 - alpha, axis=0),
+        measure + "_null_mean": null_mean,
+        measure + "_null_std": null_std,
+        measure + "_z": (observed - null_mean) / null_std,
+    })
+
+
+def complexity_significance(poi_data, category_col=selected_cat, n_bootstrap=200, n_null=200,
+                            ci=0.95, batch_size=20, n_workers=1, seed=0,
+                            min_categories=min_categories_per_location, min_pois=min_pois_per_category):
+    """
+    bootstrap intervals and null model z-scores of ECI (per location) and PCI (per category)
+    poi_data: located, filtered POIs (poi_complexity.poi_data)
+    returns a location table and a category table
+    """
+    pois = poi_data.dropna(subset=["location_name", category_col])
+    loc_codes, locs = pd.factorize(pois["location_name"], sort=True)
+    cat_codes, cats = pd.factorize(pois[category_col], sort=True)
+    shape = (len(locs), len(cats))
+
+    eci, pci = solve_counts(loc_codes, cat_codes, shape, min_categories, min_pois)
+    boot_eci, boot_pci = randomized_complexity(
+        "bootstrap", n_bootstrap, loc_codes, cat_codes, shape, min_categories, min_pois,
+        batch_size, n_workers, seed
+    )
+    null_eci, null_pci = randomized_complexity(
+        "null", n_null, loc_codes, cat_codes, shape, min_categories, min_pois,
+        batch_size, n_workers, seed
+    )
+
+    location_table = summary_table(locs, "location_name", "eci", eci, boot_eci, null_eci, ci)
+    category_table = summary_table(cats, category_col, "pci", pci, boot_pci, null_pci, ci)
+    return location_table, category_table
@@ -0,0 +1,72 @@
+import os
+import glob
+import pandas as pd
+import geopandas as gpd
+
+
+"""
+content addressed on-disk cache for pipeline stage outputs
+
+a stage output is stored as (geo)parquet under its stage name and key, keys
+are built from input file fingerprints and stage parameters by the caller,
+least recently used entries are evicted above the size limit
+"""
+
+
+class stage_cache:
+    """
+    parquet cache of DataFrames / GeoDataFrames keyed by stage name and key
+    """
+
+    def __init__(self, folder, max_size_gb=5):
+        self.folder = folder
+        self.max_bytes = max_size_gb * 1024**3
+        os.makedirs(folder, exist_ok=True)
+
+    def path(self, stage, key, geo):
+        return os.path.join(self.folder, "%s-%s%s" % (stage, key, ".geo.parquet" if geo else ".parquet"))
+
+    def find(self, stage, key):
+        for geo in [True, False]:
+            path = self.path(stage, key, geo)
+            if os.path.exists(path):
+                return path, geo
+        return None, None
+
+    def get(self, stage, key):
+        """cached output or None"""
+        path, geo = self.find(stage, key)
+        if path is None:
+            return None
+        os.utime(path)
+        read = gpd.read_parquet if geo else pd.read_parquet
+        return read(path, memory_map=True)
+
+    def put(self, stage, key, df):
+        geo = isinstance(df, gpd.GeoDataFrame)
+        path = self.path(stage, key, geo)
+        df.to_parquet(path + ".tmp")
+        os.replace(path + ".tmp", path)
+        self.evict()
+
+    def get_or_compute(self, stage, key, compute):
+        df = self.get(stage, key)
+        if df is None:
+            df = compute()
+            self.put(stage, key, df)
+        return df
+
+    def evict(self):
+        """drop least recently used entries until the cache fits the size limit"""
+        paths = sorted(glob.glob(os.path.join(self.folder, "*.parquet")), key=os.path.getmtime)
+        total = sum(os.path.getsize(p) for p in paths)
+        # the newest entry always stays
+        for p in paths[:-1]:
+            if total <= self.max_bytes:
+                break
+            total -= os.path.getsize(p)
+            os.remove(p)
+
+    def clear(self):
+        for p in glob.glob(os.path.join(self.folder, "*.parquet")):
+            os.remove(p)
@@ -0,0 +1,100 @@
+import os
+import glob
+import json
+import pandas as pd
+from pandas.api.types import union_categoricals
+import geopandas as gpd
+import pyarrow.parquet as pq
+
+
+"""
+typed columnar storage of the handoff tables -- compressed parquet (geoparquet
+for GeoDataFrames) with dictionary encoded keys, and month partitioned tables
+with one parquet file per year_month
+"""
+
+
+compression = "zstd"
+
+
+def write_table(df, path, schema=None, dictionary_cols=None):
+    """
+    write a typed table atomically -- schema: {column: dtype} enforced on write,
+    dictionary_cols: key columns stored dictionary encoded (categorical)
+    """
+    if schema is not None:
+        df = df.astype(schema)
+    if dictionary_cols is not None:
+        df = df.astype({c: "category" for c in dictionary_cols})
+
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    df.to_parquet(path + ".tmp", compression=compression, index=False)
+    os.replace(path + ".tmp", path)
+    return path
+
+
+def geometry_columns(path):
+    """geometry columns recorded in the geoparquet metadata, empty for plain parquet"""
+    metadata = pq.read_schema(path).metadata or {}
+    if b"geo" not in metadata:
+        return []
+    return list(json.loads(metadata[b"geo"])["columns"])
+
+
+def read_table(path, columns=None):
+    """read the selected columns -- a GeoDataFrame when geometry columns are among them"""
+    geometries = geometry_columns(path)
+    if geometries and (columns is None or any(c in geometries for c in columns)):
+        return gpd.read_parquet(path, columns=columns)
+    return pd.read_parquet(path, columns=columns)
+
+
+def partition_path(root, partition):
+    return os.path.join(root, str(partition) + ".parquet")
+
+
+def write_partition(df, root, partition):
+    """write (or replace) one partition, atomically"""
+    os.makedirs(root, exist_ok=True)
+    path = partition_path(root, partition)
+    tmp_path = path + ".tmp"
+    df.to_parquet(tmp_path, engine="pyarrow", compression=compression, index=False)
+    os.replace(tmp_path, path)
+    return path
+
+
+def write_partitions(df, root, partition_col="year_month"):
+    """split a table by partition_col and write every part"""
+    return [write_partition(part, root, key) for key, part in df.groupby(partition_col)]
+
+
+def list_partitions(root):
+    paths = sorted(glob.glob(os.path.join(root, "*.parquet")))
+    return [os.path.basename(p)[:-len(".parquet")] for p in paths]
+
+
+def read_partitions(root, partitions=None, columns=None):
+    """read the selected partitions (all by default) and columns only"""
+    available = list_partitions(root)
+    if partitions is None:
+        partitions = available
+    else:
+        missing = [p for p in partitions if p not in available]
+        if missing:
+            raise FileNotFoundError("partitions not found in %s: %s" % (root, missing))
+
+    parts = [
+        pd.read_parquet(partition_path(root, p), engine="pyarrow", columns=columns)
+        for p in partitions
+    ]
+    if len(parts) == 0:
+        return pd.DataFrame(columns=columns)
+
+    # months have different category sets -- unify them, so the concat keeps
+    # categorical keys instead of falling back to object
+    for col in parts[0].columns:
+        if all(col in p.columns and isinstance(p[col].dtype, pd.CategoricalDtype) for p in parts):
+            categories = union_categoricals([p[col] for p in parts], ignore_order=True).categories
+            for p in parts:
+                p[col] = p[col].cat.set_categories(categories)
+    return pd.concat(parts, ignore_index=True)
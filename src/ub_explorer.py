@@ -8,7 +8,12 @@ from shapely.geometry import Point, Polygon, LineString
 from geopy import distance
 import time
 import math
+import queue
+import threading
+import pyarrow.dataset as ds
 from parquetranger import TableRepo
+from h3_index import geo_to_h3_array, geo_to_h3_int
+from instrumentation import stage_recorder, record_drop
 
 
 """
@@ -16,26 +21,135 @@ create tables for home / work / third places based on stop detection results
 """
 
 
+# parameters
+path_stops_folder = "/mnt/common-ssd/anet-shares/mobility-data/repartitioned-semantic-stops/"
+
+
+def stops_file(period):
+    return path_stops_folder + period + ".parquet"
+
+
+def prefetch_periods(periods, max_prefetch=1, **kwargs):
+    """
+    ub_explorer of each period in order -- a background thread reads the next
+    periods while the current one is processed, at most max_prefetch loaded
+    periods wait in the queue (plus the one being read)
+    kwargs are passed to ub_explorer
+    """
+    loaded = queue.Queue(maxsize=max_prefetch)
+    stop = threading.Event()
+
+    def put(item):
+        # give up when the consumer has stopped iterating
+        while not stop.is_set():
+            try:
+                loaded.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def load():
+        try:
+            for period in periods:
+                if stop.is_set() or not put((ub_explorer(period=period, **kwargs), None)):
+                    return
+        except Exception as error:
+            put((None, error))
+            return
+        put((None, None))
+
+    thread = threading.Thread(target=load, name="prefetch_periods", daemon=True)
+    thread.start()
+    try:
+        while True:
+            ub, error = loaded.get()
+            if error is not None:
+                raise error
+            if ub is None:
+                return
+            yield ub
+    finally:
+        stop.set()
+        thread.join()
+
+
 class ub_explorer:
     """
     class to create tables for key locations -- supporting explorative work
     """
 
-    def __init__(self, period="2020-01"):
+    # columns and row filters the table builders need -- pushed into the parquet reader
+    columns = [
+        "device_id",
+        "year_month",
+        "place_label",
+        "center__lon",
+        "center__lat",
+        "stop_number",
+        "home__identified",
+        "work__identified",
+        "interval__start",
+        "duration",
+    ]
+    filters = [("place_label", ">", 0)]
+
+    def __init__(self, period="2020-01", columns=None, filters=None, stream=False, load=True,
+                 recorder=None):
         self.period = period
-        
-        print("Loading data..", end="")
-        self.data = self.load_data()
-        print(" DONE")
+        if columns is not None:
+            self.columns = columns
+        if filters is not None:
+            self.filters = filters
+        self.stream = stream
+        self.recorder = recorder if recorder is not None else stage_recorder(period=period)
 
-    def load_data(self):
-        df = pd.read_parquet(
-            "/mnt/common-ssd/anet-shares/mobility-data/repartitioned-semantic-stops/"+
-            self.period+
-            ".parquet",
-            engine="pyarrow"
+        # load=False -- no in-memory data, read through scanner / iter_batches
+        self.data = None
+        if load:
+            with self.recorder.stage("load_data") as record:
+                self.data = self.load_data()
+                record["rows_out"] = len(self.data)
+
+    def filter_expression(self):
+        """row filters as (column, op, value) tuples to a pyarrow expression"""
+        ops = {
+            "==": lambda f, v: f == v,
+            "!=": lambda f, v: f != v,
+            ">": lambda f, v: f > v,
+            ">=": lambda f, v: f >= v,
+            "<": lambda f, v: f < v,
+            "<=": lambda f, v: f <= v,
+            "in": lambda f, v: f.isin(v),
+        }
+        expression = None
+        for col, op, value in self.filters or []:
+            condition = ops[op](ds.field(col), value)
+            expression = condition if expression is None else expression & condition
+        return expression
+
+    def scanner(self, batch_size=1_000_000):
+        dataset = ds.dataset(stops_file(self.period), format="parquet")
+        return dataset.scanner(
+            columns=self.columns, filter=self.filter_expression(), batch_size=batch_size
         )
-        
+
+    def iter_batches(self, batch_size=1_000_000):
+        """stream the projected and filtered stops of the period as DataFrames"""
+        for batch in self.scanner(batch_size).to_batches():
+            if batch.num_rows > 0:
+                yield batch.to_pandas()
+
+    def load_data(self):
+        scanner = self.scanner()
+        if self.stream:
+            # batch by batch to pandas -- the arrow copy of the month never exists at once
+            parts = list(self.iter_batches())
+            if len(parts) == 0:
+                return scanner.projected_schema.empty_table().to_pandas()
+            return pd.concat(parts, ignore_index=True)
+
+        df = scanner.to_table().to_pandas()
         return df
 
     def place_of_the_month(self, stop_detection_data, location_type, h3_resolution):
@@ -64,13 +178,17 @@ class ub_explorer:
         )
 
         # mean is based on 10 stops at least
+        rows_before = len(df)
         df = df[df["nr_stops"] >= 10]
+        record_drop(location_type + ": min 10 stops", rows_before, len(df))
 
         # drop cases with above threshold std
+        rows_before = len(df)
         df = df[(df["std_lon"] <= 0.001) & (df["std_lat"] <= 0.001)]
+        record_drop(location_type + ": std threshold", rows_before, len(df))
 
         # add h3 hex based on h3_resolution
-        df["h3"] = df.apply(lambda r: h3.geo_to_h3(r["mean_lat"], r["mean_lon"], h3_resolution), axis=1)
+        df["h3"] = geo_to_h3_array(df["mean_lat"].to_numpy(), df["mean_lon"].to_numpy(), h3_resolution)
 
         return df
 
@@ -112,8 +230,78 @@ class ub_explorer:
         # third_df = third_df[(third_df["std_lon"] <= 0.001) & (third_df["std_lat"] <= 0.001)]
         
         # add price group to third place
-        third_df["h3"] = third_df.apply(lambda r: h3.geo_to_h3(r["mean_lat"], r["mean_lon"], h3_resolution), axis=1)
+        third_df["h3"] = geo_to_h3_array(third_df["mean_lat"].to_numpy(), third_df["mean_lon"].to_numpy(), h3_resolution)
         
         return third_df
 
-    
\ No newline at end of file
+    def key_places_tables(self, data, h3_resolution, compact=False):
+        """
+        home, work and third place tables from a single grouped pass over the month
+        same results as place_of_the_month (home, work) and third_places_table
+        compact: uint64 h3 cells and categorical device_id / year_month keys
+        """
+        place = data["place_label"].to_numpy() > 0
+        home_flag = data["home__identified"].to_numpy()
+        work_flag = data["work__identified"].to_numpy()
+
+        # rows of each table, tagged by role -- a stop can be both home and work
+        rows = [
+            np.flatnonzero((home_flag == 1) & place),
+            np.flatnonzero((work_flag == 1) & place),
+            np.flatnonzero((home_flag == 0) & (work_flag == 0) & place),
+        ]
+        role = np.repeat([0, 1, 2], [len(r) for r in rows])
+        rows = np.concatenate(rows)
+
+        df = data[["device_id", "year_month", "place_label", "stop_number",
+                   "center__lon", "center__lat", "duration"]].take(rows)
+        df["dayofmonth"] = data["interval__start"].dt.day.to_numpy()[rows]
+        df["role"] = role
+        if compact:
+            df["device_id"] = df["device_id"].astype("category")
+            df["year_month"] = df["year_month"].astype("category")
+
+        # home / work are per device -- one placeholder label (labels are > 0)
+        df["place_label"] = np.where(role == 2, df["place_label"].to_numpy(), 0)
+
+        df = (
+            df.groupby(["role", "device_id", "year_month", "place_label"], observed=True)
+            .agg(
+                nr_visits = pd.NamedAgg("stop_number", "count"),
+                nr_days = pd.NamedAgg("dayofmonth", "nunique"),
+                mean_lon = pd.NamedAgg("center__lon", "mean"),
+                mean_lat = pd.NamedAgg("center__lat", "mean"),
+                std_lon = pd.NamedAgg("center__lon", "std"),
+                std_lat = pd.NamedAgg("center__lat", "std"),
+                mean_duration = pd.NamedAgg("duration", "mean")
+            )
+            .reset_index()
+        )
+
+        tables = []
+        for r, location_type in [(0, "home"), (1, "work")]:
+            place_df = df.loc[df["role"] == r, ["device_id", "year_month", "mean_lon", "mean_lat",
+                                                 "std_lon", "std_lat", "nr_visits"]]
+            place_df = place_df.rename(columns={"nr_visits": "nr_stops"}).reset_index(drop=True)
+
+            # mean is based on 10 stops at least
+            rows_before = len(place_df)
+            place_df = place_df[place_df["nr_stops"] >= 10]
+            record_drop(location_type + ": min 10 stops", rows_before, len(place_df))
+
+            # drop cases with above threshold std
+            rows_before = len(place_df)
+            place_df = place_df[(place_df["std_lon"] <= 0.001) & (place_df["std_lat"] <= 0.001)]
+            record_drop(location_type + ": std threshold", rows_before, len(place_df))
+            tables.append(place_df)
+
+        third_df = df[df["role"] == 2].drop(columns=["role"]).reset_index(drop=True)
+        tables.append(third_df)
+
+        # add h3 hex based on h3_resolution
+        h3_cells = geo_to_h3_int if compact else geo_to_h3_array
+        for t in tables:
+            t["h3"] = h3_cells(t["mean_lat"].to_numpy(), t["mean_lon"].to_numpy(), h3_resolution)
+
+        home_df, work_df, third_df = tables
+        return home_df, work_df, third_df